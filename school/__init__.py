@@ -4,5 +4,6 @@
 # A Module for School Management System
 # ----------------------------------------------------------
 
+from . import controllers
 from . import models
 from . import wizard
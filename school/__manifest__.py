@@ -2,7 +2,7 @@
 
 {
     'name': 'School',
-    'version': '13.0.1.0.0',
+    'version': '13.0.1.2.0',
     'author': 'Serpent Consulting Services Pvt. Ltd.',
     'website': 'http://www.serpentcs.com',
     'category': 'School Management',
@@ -20,8 +20,13 @@
              'views/teacher_view.xml',
              'views/parent_view.xml',
              'data/student_sequence.xml',
+             'data/school_cron.xml',
              'wizard/assign_roll_no_wizard.xml',
              'wizard/move_standards_view.xml',
+             'wizard/student_export_view.xml',
+             'wizard/school_clone_view.xml',
+             'views/attendance_view.xml',
+             'views/job_view.xml',
              'views/report_view.xml',
              'views/identity_card.xml',
              'views/template_view.xml'],
@@ -0,0 +1,243 @@
+# See LICENSE file for full copyright and licensing details.
+
+import base64
+import hashlib
+import io
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from werkzeug.exceptions import BadRequest, NotFound
+from werkzeug.wsgi import wrap_file
+
+from odoo import api, http
+from odoo.fields import Datetime
+from odoo.http import request, Response, content_disposition
+from odoo.tools import date_utils
+
+# Binary fields served by the streaming download route
+SCHOOL_BINARIES = {('subject.syllabus', 'syllabus_doc'),
+                   ('student.certificate', 'certi'),
+                   ('student.document', 'new_datas'),
+                   ('student.student', 'photo')}
+
+# Resources of the sync API: model and fields returned by default
+SCHOOL_API_RESOURCES = {
+    'students': ('student.student',
+                 ['pid', 'student_code', 'name', 'middle', 'last', 'email',
+                  'gender', 'date_of_birth', 'school_id', 'standard_id',
+                  'roll_no', 'year', 'parent_id', 'state', 'active']),
+    'standards': ('school.standard',
+                  ['name', 'school_id', 'standard_id', 'division_id',
+                   'medium_id', 'user_id', 'capacity', 'student_ids']),
+    'teachers': ('school.teacher',
+                 ['name', 'work_email', 'school_id', 'standard_id',
+                  'subject_id', 'active']),
+}
+SCHOOL_API_MAX_LIMIT = 1000
+# Timestamps of the sync API cursors, to the microsecond
+SCHOOL_API_CURSOR_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def _parse_timestamp(value):
+    '''Parse a UTC timestamp of a cursor or of changed_since'''
+    try:
+        value = value.replace('T', ' ', 1)
+        if '.' in value:
+            return datetime.strptime(value, SCHOOL_API_CURSOR_FORMAT)
+        return Datetime.to_datetime(value)
+    except (AttributeError, TypeError, ValueError):
+        raise BadRequest('Invalid timestamp: %s' % value)
+
+
+class SchoolController(http.Controller):
+
+    @http.route('/school/news/feed', type='json', auth='user')
+    def news_feed(self, limit=20, cursor=None, mark_read=None):
+        '''Return a page of the user's news feed with the unread counter.
+           News ids passed in mark_read are flagged as read first.'''
+        news_obj = request.env['student.news']
+        if mark_read:
+            news_obj.browse([int(news_id) for news_id in mark_read]
+                            ).exists().mark_read()
+        return news_obj.get_feed(limit=min(int(limit), 200), cursor=cursor)
+
+    @http.route('/school/student/events', type='json', auth='user')
+    def student_events(self, cursor=None, limit=500):
+        '''Return the next batch of student lifecycle events after cursor,
+           for the library, transport and billing consumers.'''
+        return request.env['student.event'].read_events(
+            cursor=cursor, limit=min(int(limit), 5000))
+
+    @http.route('/school/attendance/mark', type='json', auth='user')
+    def attendance_mark(self, standard_id, date, absent_ids=(), late_ids=(),
+                        excused_ids=(), type_id=False, period=1):
+        '''Mark the attendance of a class in one call, the students not
+           listed being present. Return the id of the attendance sheet.'''
+        return request.env['school.attendance.sheet'].mark_class(
+            int(standard_id), date, absent_ids=absent_ids,
+            late_ids=late_ids, excused_ids=excused_ids, type_id=type_id,
+            period=int(period)).id
+
+    @http.route('/school/binary/<string:model>/<int:res_id>/<string:field>',
+                type='http', auth='user')
+    def download_binary(self, model, res_id, field, download=None, **kw):
+        '''Stream a school document from the filestore without loading it
+           in memory, with ETag and Range support.'''
+        if (model, field) not in SCHOOL_BINARIES:
+            raise NotFound()
+        record = request.env[model].browse(res_id).exists()
+        if not record:
+            raise NotFound()
+        record.check_access_rights('read')
+        record.check_access_rule('read')
+        attachment = request.env['ir.attachment'].sudo().search(
+            [('res_model', '=', model), ('res_field', '=', field),
+             ('res_id', '=', res_id)], limit=1)
+        if not attachment:
+            raise NotFound()
+        if attachment.store_fname:
+            path = attachment._full_path(attachment.store_fname)
+            if not os.path.exists(path):
+                raise NotFound()
+            size = os.path.getsize(path)
+            data = open(path, 'rb')
+        else:
+            content = base64.b64decode(attachment.datas or b'')
+            size = len(content)
+            data = io.BytesIO(content)
+        headers = [('Content-Length', size)]
+        if download:
+            filename = attachment.name or '%s-%s' % (field, res_id)
+            headers.append(('Content-Disposition',
+                            content_disposition(filename)))
+        response = Response(wrap_file(request.httprequest.environ, data),
+                            headers=headers, direct_passthrough=True,
+                            mimetype=(attachment.mimetype or
+                                      'application/octet-stream'))
+        response.set_etag(attachment.checksum or '%s-%s' % (attachment.id,
+                                                             size))
+        response.cache_control.private = True
+        response.cache_control.max_age = 0
+        return response.make_conditional(request.httprequest,
+                                         accept_ranges=True,
+                                         complete_length=size)
+
+    @http.route('/school/export/students', type='http', auth='user')
+    def export_students(self, school_id=None, standard_id=None, fields=None,
+                        file_format='csv', **kw):
+        '''Download the students of a school or the roster of a class.
+           fields is a comma separated list of student field names. The CSV
+           is sent while it is produced, from a cursor of its own since the
+           request cursor is closed once the response is returned.'''
+        request.env['student.student'].check_access_rights('read')
+        vals = {'file_format': file_format if file_format == 'xlsx'
+                else 'csv'}
+        if school_id:
+            vals['school_id'] = int(school_id)
+        if standard_id:
+            vals['standard_id'] = int(standard_id)
+        if fields:
+            vals['field_ids'] = [(6, 0, request.env['ir.model.fields'].search(
+                [('model', '=', 'student.student'),
+                 ('name', 'in', fields.split(','))]).ids)]
+        export = request.env['student.export'].create(vals)
+        headers = [('Content-Disposition',
+                    content_disposition(export._get_filename()))]
+        if export.file_format == 'xlsx':
+            # xlsx files are zip archives written once the sheet is done
+            data = tempfile.TemporaryFile()
+            export.write_export(data)
+            headers.append(('Content-Length', data.tell()))
+            data.seek(0)
+            return Response(wrap_file(request.httprequest.environ, data),
+                            headers=headers, direct_passthrough=True,
+                            mimetype=export._get_mimetype())
+        registry, uid, context = (request.registry, request.uid,
+                                  dict(request.context))
+        export_id = export.id
+
+        def generate():
+            # Runs once the request has returned and committed the export
+            with api.Environment.manage(), registry.cursor() as cr:
+                env = api.Environment(cr, uid, context)
+                yield from env['student.export'].browse(export_id).iter_csv()
+
+        return Response(generate(), headers=headers, direct_passthrough=True,
+                        mimetype=export._get_mimetype())
+
+    @http.route('/school/api/<string:resource>', type='http', auth='user',
+                methods=['GET'])
+    def api_records(self, resource, fields=None, limit=200, cursor=None,
+                    changed_since=None, **kw):
+        '''Return a page of students, classes or teachers as JSON for the
+           SIS and LMS integrations.
+
+           Records are ordered by (write_date, id) and paginated on that
+           key: pass the returned `next_cursor` as `cursor` to get the
+           following page. Keeping the last cursor of a sync and passing it
+           the next time returns the records written since; class rosters
+           are kept in sync from the class and state of the students. The
+           write date is the start of the writing transaction, so a record
+           committed after a sync can carry an earlier date than its cursor:
+           incremental syncs should restart from `changed_since` a few
+           minutes before their last cursor and upsert the records again.
+           `fields` is a comma separated projection. Pages carry an ETag of
+           their content, so an unchanged page answers 304 without a body.'''
+        if resource not in SCHOOL_API_RESOURCES:
+            raise NotFound()
+        model_name, default_fields = SCHOOL_API_RESOURCES[resource]
+        model = request.env[model_name]
+        if changed_since or cursor:
+            # Archived records are part of what changed
+            model = model.with_context(active_test=False)
+        model.check_access_rights('read')
+        names = fields.split(',') if fields else default_fields
+        names = [name for name in names if name in model._fields]
+        if not names:
+            raise BadRequest('No known field requested')
+        if any(model._fields[name].type == 'binary' for name in names):
+            raise BadRequest('Binary fields are not served by this API')
+        try:
+            limit = max(1, min(int(limit), SCHOOL_API_MAX_LIMIT))
+        except ValueError:
+            raise BadRequest('Invalid limit')
+        query = model._where_calc([])
+        model._apply_ir_rules(query, 'read')
+        from_clause, where_clause, params = query.get_sql()
+        table = '"%s"' % model._table
+        # Rows written by SQL without write date have no place in the order
+        conditions = [where_clause or 'TRUE',
+                      '%s.write_date IS NOT NULL' % table]
+        if changed_since:
+            conditions.append('%s.write_date > %%s' % table)
+            params.append(_parse_timestamp(changed_since))
+        if cursor:
+            write_date, _sep, res_id = cursor.rpartition(',')
+            if not res_id.isdigit():
+                raise BadRequest('Invalid cursor')
+            conditions.append('(%s.write_date, %s.id) > (%%s, %%s)'
+                              % (table, table))
+            params += [_parse_timestamp(write_date), int(res_id)]
+        model.flush()
+        request.env.cr.execute(
+            'SELECT %s.id, %s.write_date FROM %s WHERE %s '
+            'ORDER BY %s.write_date, %s.id LIMIT %%s'
+            % (table, table, from_clause, ' AND '.join(conditions), table,
+               table), params + [limit])
+        keys = request.env.cr.fetchall()
+        records = model.browse([key[0] for key in keys]).read(names)
+        next_cursor = cursor
+        if keys:
+            next_cursor = '%s,%s' % (
+                keys[-1][1].strftime(SCHOOL_API_CURSOR_FORMAT), keys[-1][0])
+        body = json.dumps({'records': records,
+                           'next_cursor': next_cursor,
+                           'has_more': len(keys) == limit},
+                          default=date_utils.json_default).encode('utf-8')
+        response = Response(body, mimetype='application/json')
+        response.set_etag(hashlib.sha1(body).hexdigest())
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request.httprequest)
@@ -0,0 +1,53 @@
+# See LICENSE file for full copyright and licensing details.
+
+import logging
+
+from odoo import api, SUPERUSER_ID
+
+_logger = logging.getLogger(__name__)
+
+# (model, table, field) of the binaries moved to the filestore
+BINARY_FIELDS = [('subject.syllabus', 'subject_syllabus', 'syllabus_doc'),
+                 ('student.certificate', 'student_certificate', 'certi'),
+                 ('student.document', 'student_document', 'new_datas'),
+                 ('student.student', 'student_student', 'photo')]
+
+BATCH_SIZE = 100
+
+
+def migrate(cr, version):
+    '''Move the binaries stored in the business tables to attachments. The
+       filestore names files by checksum, so identical documents are only
+       written once on disk.'''
+    if not version:
+        return
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    attachment_obj = env['ir.attachment']
+    for model, table, field in BINARY_FIELDS:
+        cr.execute("""SELECT 1 FROM information_schema.columns
+                      WHERE table_name = %s AND column_name = %s""",
+                   (table, field))
+        if not cr.fetchone():
+            continue
+        moved = 0
+        while True:
+            cr.execute('SELECT id, "%s" FROM "%s" WHERE "%s" IS NOT NULL '
+                       'ORDER BY id LIMIT %s' % (field, table, field,
+                                                 BATCH_SIZE))
+            rows = cr.fetchall()
+            if not rows:
+                break
+            attachment_obj.create([{'name': field,
+                                    'res_model': model,
+                                    'res_field': field,
+                                    'res_id': res_id,
+                                    'type': 'binary',
+                                    'datas': bytes(value)}
+                                   for res_id, value in rows])
+            cr.execute('UPDATE "%s" SET "%s" = NULL WHERE id IN %%s'
+                       % (table, field), (tuple(row[0] for row in rows),))
+            attachment_obj.invalidate_cache()
+            moved += len(rows)
+        cr.execute('ALTER TABLE "%s" DROP COLUMN "%s"' % (table, field))
+        _logger.info('Moved %s values of %s.%s to the filestore', moved,
+                     model, field)
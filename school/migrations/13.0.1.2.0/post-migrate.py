@@ -0,0 +1,29 @@
+# See LICENSE file for full copyright and licensing details.
+
+import logging
+
+from odoo import api, SUPERUSER_ID
+from odoo.tools import split_every
+
+_logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+
+
+def migrate(cr, version):
+    '''Generate the resized variants of the existing student photos'''
+    if not version:
+        return
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    student_obj = env['student.student'].with_context(active_test=False)
+    variants = [student_obj._fields['photo_512'],
+                student_obj._fields['photo_128']]
+    student_ids = student_obj.search([]).ids
+    for batch in split_every(BATCH_SIZE, student_ids):
+        students = student_obj.browse(batch)
+        for field in variants:
+            env.add_to_compute(field, students)
+        students.recompute()
+        students.flush()
+        students.invalidate_cache()
+    _logger.info('Generated photo variants of %s students', len(student_ids))
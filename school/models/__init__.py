@@ -9,3 +9,11 @@ from . import student
 from . import teacher
 from . import parent
 from . import res_users
+from . import school_sequence
+from . import student_archive
+from . import elective
+from . import timetable
+from . import enrolment_report
+from . import student_event
+from . import attendance
+from . import school_job
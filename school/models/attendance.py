@@ -0,0 +1,305 @@
+# See LICENSE file for full copyright and licensing details.
+
+import json
+
+from odoo import models, fields, api, _
+from odoo.exceptions import ValidationError
+
+# Status codes stored in the marks of an attendance sheet
+ATTENDANCE_STATUS = [('p', 'Présent'),
+                     ('a', 'Absent'),
+                     ('l', 'En retard'),
+                     ('e', 'Excusé')]
+
+
+class SchoolAttendanceSheet(models.Model):
+    '''Attendance of a class for one session.
+
+       A sheet is one row per class, date, attendance type and period. The
+       status of every student of the class is kept in `marks`, a JSON
+       object mapping student ids to status codes, so marking a class of
+       40 students writes a single row.'''
+
+    _name = 'school.attendance.sheet'
+    _description = "Feuille de présence"
+    _order = 'date desc, standard_id, period'
+
+    standard_id = fields.Many2one('school.standard', 'Classe', required=True,
+                                  index=True, ondelete='cascade')
+    school_id = fields.Many2one('school.school', 'École',
+                                related='standard_id.school_id', store=True)
+    date = fields.Date('Date', required=True, index=True,
+                       default=fields.Date.context_today)
+    type_id = fields.Many2one('attendance.type', 'Type de présence')
+    period = fields.Integer('Période', default=1)
+    teacher_id = fields.Many2one('school.teacher', 'Professeur')
+    month_id = fields.Many2one('academic.month', 'Mois académique',
+                               compute='_compute_month', store=True,
+                               index=True)
+    year_id = fields.Many2one('academic.year', 'Année académique',
+                              related='month_id.year_id', store=True)
+    marks = fields.Text('Statuts', default='{}')
+    student_count = fields.Integer("Nombre d'étudiants",
+                                   compute='_compute_counts', store=True)
+    absent_count = fields.Integer('Absents', compute='_compute_counts',
+                                  store=True)
+    absent_ids = fields.Many2many('student.student', string='Absents',
+                                  compute='_compute_students',
+                                  inverse='_inverse_absent')
+    late_ids = fields.Many2many('student.student', string='En retard',
+                                compute='_compute_students',
+                                inverse='_inverse_late')
+    excused_ids = fields.Many2many('student.student', string='Excusés',
+                                   compute='_compute_students',
+                                   inverse='_inverse_excused')
+    summary_dirty = fields.Boolean('Synthèse à recalculer', default=True,
+                                   readonly=True, copy=False)
+
+    def init(self):
+        '''One sheet per session, sessions without type or period included,
+           which a unique constraint would let through as NULLs differ'''
+        self._cr.execute("""CREATE UNIQUE INDEX IF NOT EXISTS
+                              school_attendance_sheet_session_uniq
+                            ON school_attendance_sheet
+                               (standard_id, date, COALESCE(type_id, 0),
+                                COALESCE(period, 0))""")
+
+    @api.constrains('standard_id', 'date', 'type_id', 'period')
+    def check_session(self):
+        for rec in self:
+            if self.search_count([('id', '!=', rec.id),
+                                  ('standard_id', '=', rec.standard_id.id),
+                                  ('date', '=', rec.date),
+                                  ('type_id', '=', rec.type_id.id),
+                                  ('period', '=', rec.period)]):
+                raise ValidationError(_("La présence de cette séance est \
+déjà saisie pour la classe!"))
+
+    def get_marks(self):
+        '''Return the marks of the sheet as a dict student id -> status'''
+        self.ensure_one()
+        return {int(student_id): status for student_id, status
+                in json.loads(self.marks or '{}').items()}
+
+    @api.model
+    def _dump_marks(self, marks):
+        codes = dict(ATTENDANCE_STATUS)
+        invalid = {status for status in marks.values() if status not in codes}
+        if invalid:
+            raise ValidationError(_('Statut de présence invalide: %s')
+                                  % ', '.join(sorted(invalid)))
+        return json.dumps({str(student_id): marks[student_id]
+                           for student_id in sorted(marks)})
+
+    def set_marks(self, marks):
+        '''Store a dict student id -> status as the marks of the sheets'''
+        return self.write({'marks': self._dump_marks(marks)})
+
+    @api.depends('date')
+    def _compute_month(self):
+        dates = [date for date in self.mapped('date') if date]
+        months = self.env['academic.month']
+        if dates:
+            months = months.search([('date_start', '<=', max(dates)),
+                                    ('date_stop', '>=', min(dates))])
+        for rec in self:
+            rec.month_id = months.filtered(
+                lambda month: rec.date and
+                month.date_start <= rec.date <= month.date_stop)[:1]
+
+    @api.depends('marks')
+    def _compute_counts(self):
+        for rec in self:
+            marks = rec.get_marks()
+            rec.student_count = len(marks)
+            rec.absent_count = sum(1 for status in marks.values()
+                                   if status == 'a')
+
+    @api.depends('marks')
+    def _compute_students(self):
+        student_obj = self.env['student.student']
+        for rec in self:
+            marks = rec.get_marks()
+            for name, code in (('absent_ids', 'a'), ('late_ids', 'l'),
+                               ('excused_ids', 'e')):
+                rec[name] = student_obj.browse(
+                    [student_id for student_id, status in marks.items()
+                     if status == code])
+
+    def _inverse_status(self, name, code):
+        for rec in self:
+            marks = rec.get_marks()
+            selected = set(rec[name].ids)
+            for student_id in selected | set(marks):
+                if student_id in selected:
+                    marks[student_id] = code
+                elif marks.get(student_id) == code:
+                    marks[student_id] = 'p'
+            rec.set_marks(marks)
+
+    def _inverse_absent(self):
+        self._inverse_status('absent_ids', 'a')
+
+    def _inverse_late(self):
+        self._inverse_status('late_ids', 'l')
+
+    def _inverse_excused(self):
+        self._inverse_status('excused_ids', 'e')
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        '''New sheets mark the whole roster of the class present'''
+        standard_obj = self.env['school.standard']
+        for vals in vals_list:
+            if vals.get('marks', '{}') == '{}' and vals.get('standard_id'):
+                roster = standard_obj.browse(vals['standard_id']
+                                             ).get_roster_ids()
+                vals['marks'] = json.dumps({str(student_id): 'p'
+                                            for student_id in roster})
+        return super(SchoolAttendanceSheet, self).create(vals_list)
+
+    def write(self, vals):
+        if {'marks', 'date', 'standard_id'} & set(vals):
+            vals = dict(vals, summary_dirty=True)
+        months = self.mapped('month_id') if 'date' in vals else False
+        res = super(SchoolAttendanceSheet, self).write(vals)
+        if months:
+            # The months left by the sheets are not flagged by any sheet
+            self.env['school.attendance.summary']._compute_summaries(
+                months - self.mapped('month_id'))
+        return res
+
+    def unlink(self):
+        months = self.mapped('month_id')
+        res = super(SchoolAttendanceSheet, self).unlink()
+        self.env['school.attendance.summary']._compute_summaries(months)
+        return res
+
+    @api.model
+    def mark_class(self, standard_id, date, absent_ids=(), late_ids=(),
+                   excused_ids=(), type_id=False, period=1):
+        '''Mark the attendance of a whole class in one operation: the
+           students of the roster not listed are present. Return the sheet
+           of the session, created or updated.'''
+        standard = self.env['school.standard'].browse(standard_id)
+        marks = dict.fromkeys(standard.get_roster_ids(), 'p')
+        for student_ids, code in ((absent_ids, 'a'), (late_ids, 'l'),
+                                  (excused_ids, 'e')):
+            marks.update(dict.fromkeys(student_ids, code))
+        sheet = self.search([('standard_id', '=', standard.id),
+                             ('date', '=', date),
+                             ('type_id', '=', type_id or False),
+                             ('period', '=', period)], limit=1)
+        if sheet:
+            sheet.set_marks(marks)
+            return sheet
+        teacher = self.env['school.teacher'].search(
+            [('user_id', '=', self._uid)], limit=1)
+        return self.create({'standard_id': standard.id,
+                            'date': date,
+                            'type_id': type_id or False,
+                            'period': period,
+                            'teacher_id': teacher.id,
+                            'marks': self._dump_marks(marks)})
+
+    def name_get(self):
+        return [(rec.id, '%s - %s%s' % (
+            rec.standard_id.display_name, fields.Date.to_string(rec.date),
+            rec.type_id and ' (%s)' % rec.type_id.name or ''))
+            for rec in self]
+
+
+class SchoolAttendanceSummary(models.Model):
+    '''Attendance of a student aggregated by academic month, and by
+       academic year on the rows without month. Rebuilt from the sheets by
+       a scheduled action so reports never aggregate the sheets.'''
+
+    _name = 'school.attendance.summary'
+    _description = "Synthèse des présences"
+    _order = 'year_id, month_id, student_id'
+    _rec_name = 'student_id'
+
+    student_id = fields.Many2one('student.student', 'Étudiant', required=True,
+                                 index=True, ondelete='cascade',
+                                 readonly=True)
+    school_id = fields.Many2one('school.school', 'École', readonly=True)
+    month_id = fields.Many2one('academic.month', 'Mois académique',
+                               index=True, ondelete='cascade', readonly=True)
+    year_id = fields.Many2one('academic.year', 'Année académique',
+                              required=True, index=True, ondelete='cascade',
+                              readonly=True)
+    sessions = fields.Integer('Séances', readonly=True)
+    present = fields.Integer('Présent', readonly=True)
+    late = fields.Integer('En retard', readonly=True)
+    absent = fields.Integer('Absent', readonly=True)
+    excused = fields.Integer('Excusé', readonly=True)
+    rate = fields.Float('Taux de présence (%)', group_operator='avg',
+                        readonly=True, digits=(5, 2))
+
+    @api.model
+    def _compute_summaries(self, months):
+        '''Rebuild the monthly rows of months and the yearly rows of their
+           years from the attendance sheets'''
+        if not months:
+            return True
+        self.env['school.attendance.sheet'].flush()
+        self.env['student.student'].flush(['school_id'])
+        cr = self._cr
+        cr.execute("""DELETE FROM school_attendance_summary
+                      WHERE month_id IN %s""", (tuple(months.ids),))
+        cr.execute("""INSERT INTO school_attendance_summary
+                          (student_id, school_id, month_id, year_id,
+                           sessions, present, late, absent, excused, rate,
+                           create_uid, create_date, write_uid, write_date)
+                      SELECT st.id, st.school_id, sh.month_id, sh.year_id,
+                             COUNT(*),
+                             COUNT(*) FILTER (WHERE m.value = 'p'),
+                             COUNT(*) FILTER (WHERE m.value = 'l'),
+                             COUNT(*) FILTER (WHERE m.value = 'a'),
+                             COUNT(*) FILTER (WHERE m.value = 'e'),
+                             ROUND(100.0 * COUNT(*) FILTER (
+                                 WHERE m.value IN ('p', 'l')) / COUNT(*), 2),
+                             %s, NOW() AT TIME ZONE 'UTC',
+                             %s, NOW() AT TIME ZONE 'UTC'
+                      FROM school_attendance_sheet sh
+                      CROSS JOIN jsonb_each_text(sh.marks::jsonb) m
+                      JOIN student_student st ON st.id = m.key::integer
+                      WHERE sh.month_id IN %s
+                      GROUP BY st.id, sh.month_id, sh.year_id""",
+                   (self._uid, self._uid, tuple(months.ids)))
+        years = tuple(months.mapped('year_id').ids)
+        cr.execute("""DELETE FROM school_attendance_summary
+                      WHERE month_id IS NULL AND year_id IN %s""", (years,))
+        cr.execute("""INSERT INTO school_attendance_summary
+                          (student_id, school_id, year_id, sessions, present,
+                           late, absent, excused, rate, create_uid,
+                           create_date, write_uid, write_date)
+                      SELECT student_id, MIN(school_id), year_id,
+                             SUM(sessions), SUM(present), SUM(late),
+                             SUM(absent), SUM(excused),
+                             ROUND(100.0 * SUM(present + late) /
+                                   SUM(sessions), 2),
+                             %s, NOW() AT TIME ZONE 'UTC',
+                             %s, NOW() AT TIME ZONE 'UTC'
+                      FROM school_attendance_summary
+                      WHERE month_id IS NOT NULL AND year_id IN %s
+                      GROUP BY student_id, year_id""",
+                   (self._uid, self._uid, years))
+        self.invalidate_cache()
+        return True
+
+    @api.model
+    def update_summaries(self):
+        '''Rebuild the summaries of the months whose sheets changed since
+           the last run. Sheets are flagged clean in the same statement, so
+           a sheet marked meanwhile is picked up by the next run.'''
+        self.env['school.attendance.sheet'].flush()
+        self._cr.execute("""UPDATE school_attendance_sheet
+                            SET summary_dirty = FALSE
+                            WHERE summary_dirty AND month_id IS NOT NULL
+                            RETURNING month_id""")
+        month_ids = {row[0] for row in self._cr.fetchall()}
+        self.env['school.attendance.sheet'].invalidate_cache(
+            ['summary_dirty'])
+        return self._compute_summaries(
+            self.env['academic.month'].browse(month_ids))
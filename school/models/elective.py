@@ -0,0 +1,121 @@
+# See LICENSE file for full copyright and licensing details.
+
+import heapq
+from collections import defaultdict
+
+from odoo import models, fields, api, _
+from odoo.exceptions import ValidationError
+
+
+def solve_allocation(preferences, capacities):
+    '''Assign each student to one of its ranked subjects, maximising the
+       number of placed students then minimising the sum of the ranks.
+
+       preferences maps a student to its subjects, first choice first, and
+       capacities maps a subject to its number of seats (0 is unlimited).
+       This is a min-cost flow solved by successive shortest paths: each
+       step places the unplaced student at the end of the cheapest chain of
+       moves of already placed students ending on a subject with a free
+       seat. Chains are searched on a graph of the subjects only, whose
+       edge a -> b is the cheapest move of a student of a to b, so a step
+       costs O(subjects^2) whatever the number of students.
+
+       Return a dict student -> subject, without the students that could
+       not be placed.'''
+    cost = {student: {subject: rank for rank, subject in enumerate(subjects)}
+            for student, subjects in preferences.items()}
+    assigned = {}
+    load = defaultdict(int)
+    # subject -> heap of (rank, student) of the unplaced students
+    entries = defaultdict(list)
+    for student in sorted(cost):
+        for subject, rank in cost[student].items():
+            entries[subject].append((rank, student))
+    for heap in entries.values():
+        heapq.heapify(heap)
+    # (a, b) -> heap of (cost of moving the student from a to b, student)
+    moves = defaultdict(list)
+
+    def place(student, subject):
+        assigned[student] = subject
+        student_cost = cost[student]
+        for other, rank in student_cost.items():
+            if other != subject:
+                heapq.heappush(moves[subject, other],
+                               (rank - student_cost[subject], student))
+
+    while True:
+        dist, pred = {}, {}
+        for subject, heap in entries.items():
+            # Drop the students placed since they were pushed
+            while heap and heap[0][1] in assigned:
+                heapq.heappop(heap)
+            if heap:
+                dist[subject] = heap[0][0]
+                pred[subject] = (None, heap[0][1])
+        if not dist:
+            break
+        edges = []
+        for (src, dst), heap in moves.items():
+            # Drop the students which left src since they were pushed
+            while heap and assigned.get(heap[0][1]) != src:
+                heapq.heappop(heap)
+            if heap:
+                edges.append((src, dst, heap[0][0], heap[0][1]))
+        # Bellman-Ford, there is no negative cycle at an optimum
+        for _i in range(len(entries)):
+            changed = False
+            for src, dst, weight, moved in edges:
+                if src in dist and dist[src] + weight < dist.get(dst,
+                                                                float('inf')):
+                    dist[dst] = dist[src] + weight
+                    pred[dst] = (src, moved)
+                    changed = True
+            if not changed:
+                break
+        free = [subject for subject in dist
+                if not capacities.get(subject) or
+                load[subject] < capacities[subject]]
+        if not free:
+            break
+        subject = min(free, key=lambda sub: (dist[sub], sub))
+        load[subject] += 1
+        while True:
+            src, moved = pred[subject]
+            place(moved, subject)
+            if src is None:
+                break
+            subject = src
+    return assigned
+
+
+class SubjectElectivePreference(models.Model):
+    '''Ranked choice of a student for a subject of an elective group'''
+
+    _name = 'subject.elective.preference'
+    _description = 'Préférence de matière optionnelle'
+    _order = 'elective_id, student_id, sequence, id'
+
+    elective_id = fields.Many2one('subject.elective', 'Groupe électif',
+                                  required=True, index=True,
+                                  ondelete='cascade')
+    student_id = fields.Many2one('student.student', 'Étudiant', required=True,
+                                 index=True, ondelete='cascade')
+    subject_id = fields.Many2one('subject.subject', 'Matière', required=True,
+                                 ondelete='cascade')
+    sequence = fields.Integer('Rang', default=1,
+                              help="1 pour le premier choix.")
+
+    _sql_constraints = [
+        ('student_subject_unique', 'unique(student_id, subject_id)',
+         "Un étudiant ne peut choisir une matière qu'une fois!"),
+    ]
+
+    @api.constrains('subject_id', 'elective_id')
+    def check_subject(self):
+        '''The subject must belong to the elective group'''
+        invalid = self.filtered(
+            lambda rec: rec.subject_id.elective_id != rec.elective_id)
+        if invalid:
+            raise ValidationError(_("La matière doit appartenir au groupe \
+électif!") + '\n' + ', '.join(invalid.mapped('subject_id.name')))
@@ -0,0 +1,75 @@
+# See LICENSE file for full copyright and licensing details.
+
+from odoo import models, fields, api
+
+
+class SchoolEnrolmentReport(models.Model):
+    '''Enrolment and occupancy analysis.
+
+       Backed by a PostgreSQL materialised view, so dashboards read a
+       snapshot instead of aggregating student_student while admissions
+       write to it. The view has one row per group of students sharing
+       school, class, division, medium, gender, state and year, plus one
+       row per class holding its capacity and free seats. It is refreshed
+       concurrently by a scheduled action and after bulk operations.'''
+
+    _name = 'school.enrolment.report'
+    _description = "Analyse des effectifs"
+    _auto = False
+    _rec_name = 'standard_id'
+
+    school_id = fields.Many2one('school.school', 'École', readonly=True)
+    standard_id = fields.Many2one('school.standard', 'Classe', readonly=True)
+    division_id = fields.Many2one('standard.division', 'Division',
+                                  readonly=True)
+    medium_id = fields.Many2one('standard.medium', 'Moyen', readonly=True)
+    year_id = fields.Many2one('academic.year', 'Année scolaire',
+                              readonly=True)
+    gender = fields.Selection([('male', 'Mâle'), ('female', 'Femelle')],
+                              'Gender', readonly=True)
+    state = fields.Selection([('draft', 'Draft'),
+                              ('done', 'Done'),
+                              ('terminate', 'Terminate'),
+                              ('cancel', 'Cancel'),
+                              ('alumni', 'Alumni')], 'Statut', readonly=True)
+    student_count = fields.Integer("Nombre d'étudiants", readonly=True)
+    capacity = fields.Integer('Places', readonly=True)
+    remaining_seats = fields.Integer('Places libres', readonly=True)
+
+    def init(self):
+        '''(Re)create the materialised view and the unique index needed by
+           concurrent refreshes. Student groups use the id of their first
+           student and class rows the opposite of the class id, so ids are
+           stable between refreshes.'''
+        self._cr.execute("DROP MATERIALIZED VIEW IF EXISTS %s" % self._table)
+        self._cr.execute("""
+            CREATE MATERIALIZED VIEW %s AS (
+                SELECT MIN(s.id) AS id, s.school_id, s.standard_id,
+                       s.division_id, s.medium_id, s.year AS year_id,
+                       s.gender, s.state, COUNT(*) AS student_count,
+                       0 AS capacity, 0 AS remaining_seats
+                FROM student_student s
+                GROUP BY s.school_id, s.standard_id, s.division_id,
+                         s.medium_id, s.year, s.gender, s.state
+                UNION ALL
+                SELECT -c.id, c.school_id, c.id, c.division_id, c.medium_id,
+                       NULL, NULL, NULL, 0, c.capacity,
+                       c.capacity - COUNT(s.id)
+                FROM school_standard c
+                LEFT JOIN student_student s
+                       ON s.standard_id = c.id AND s.state = 'done'
+                      AND s.active
+                GROUP BY c.id
+            )""" % self._table)
+        self._cr.execute("CREATE UNIQUE INDEX %s_id_idx ON %s (id)"
+                         % (self._table, self._table))
+
+    @api.model
+    def refresh(self):
+        '''Refresh the snapshot without blocking the dashboard readers'''
+        self.env['student.student'].flush()
+        self.env['school.standard'].flush()
+        self._cr.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY %s"
+                         % self._table)
+        self.invalidate_cache()
+        return True
@@ -1,6 +1,15 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
-from odoo import models, fields, api
+import base64
+import csv
+import io
+import logging
+import threading
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError, ValidationError
+
+_logger = logging.getLogger(__name__)
 
 
 class ParentRelation(models.Model):
@@ -18,18 +27,14 @@ class SchoolParent(models.Model):
     _name = 'school.parent'
     _description = 'Information sur les parents'
 
-    @api.onchange('student_id')
-    def onchange_student_id(self):
-        """Onchange Method for Student."""
-        self.standard_id = [(6, 0, [])]
-        self.stand_id = [(6, 0, [])]
-        standard_ids = [student.standard_id.id
-                        for student in self.student_id]
-        if standard_ids:
-            stand_ids = [student.standard_id.standard_id.id
-                         for student in self.student_id]
-            self.standard_id = [(6, 0, standard_ids)]
-            self.stand_id = [(6, 0, stand_ids)]
+    @api.depends('student_id.standard_id',
+                 'student_id.standard_id.standard_id')
+    def _compute_class_links(self):
+        """Compute the classes and standards of the children."""
+        for rec in self:
+            standards = rec.student_id.mapped('standard_id')
+            rec.standard_id = [(6, 0, standards.ids)]
+            rec.stand_id = [(6, 0, standards.mapped('standard_id').ids)]
 
     partner_id = fields.Many2one('res.partner', "Identifiant d'utilisateur", ondelete="cascade",
                                  delegate=True, required=True)
@@ -40,30 +45,90 @@ class SchoolParent(models.Model):
     standard_id = fields.Many2many('school.standard',
                                    'school_standard_parent_rel',
                                    'class_parent_id', 'class_id',
-                                   'Classe académique')
+                                   'Classe académique',
+                                   compute='_compute_class_links', store=True)
     stand_id = fields.Many2many('standard.standard',
                                 'standard_standard_parent_rel',
                                 'standard_parent_id', 'standard_id',
-                                'Norme académique')
+                                'Norme académique',
+                                compute='_compute_class_links', store=True)
     teacher_id = fields.Many2one('school.teacher', 'Professeur',
-                                 related="standard_id.user_id", store=True)
+                                 related="standard_id.user_id", store=True,
+                                 index=True)
+    user_setup_pending = fields.Boolean('Configuration du compte en attente',
+                                        index=True, copy=False,
+                                        help="Invitation et mot de passe du \
+portail pas encore envoyés.")
+    user_setup_error = fields.Text("Erreur de configuration du compte",
+                                   readonly=True, copy=False)
 
-    @api.model
-    def create(self, vals):
-        parent_id = super(SchoolParent, self).create(vals)
+    def _prepare_user_vals(self):
+        '''Values of the portal user created for a parent'''
+        self.ensure_one()
         parent_grp_id = self.env.ref('school.group_school_parent')
         emp_grp = self.env.ref('base.group_user')
-        parent_group_ids = [emp_grp.id, parent_grp_id.id]
-        if vals.get('parent_create_mng'):
-            return parent_id
-        user_vals = {'name': parent_id.name,
-                     'login': parent_id.email,
-                     'email': parent_id.email,
-                     'partner_id': parent_id.partner_id.id,
-                     'groups_id': [(6, 0, parent_group_ids)]
-                     }
-        self.env['res.users'].create(user_vals)
-        return parent_id
+        return {'name': self.name,
+                'login': self.email,
+                'email': self.email,
+                'partner_id': self.partner_id.id,
+                'groups_id': [(6, 0, [emp_grp.id, parent_grp_id.id])]
+                }
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        '''Create the parents and their users in one batch. With the
+           context key `parent_defer_user_setup`, the invitation and
+           password setup are left to the scheduled job.'''
+        parents = super(SchoolParent, self).create(vals_list)
+        to_setup = self.browse()
+        for parent, vals in zip(parents, vals_list):
+            if not vals.get('parent_create_mng'):
+                to_setup |= parent
+        if not to_setup:
+            return parents
+        user_obj = self.env['res.users']
+        defer = self._context.get('parent_defer_user_setup')
+        if defer:
+            user_obj = user_obj.with_context(no_reset_password=True)
+        user_obj.create([parent._prepare_user_vals() for parent in to_setup])
+        if defer:
+            to_setup.write({'user_setup_pending': True})
+        return parents
+
+    @api.model
+    def _cron_setup_parent_users(self, batch_size=200):
+        '''Send invitations (signup token and welcome mail) to parents whose
+           account was created by a bulk import. Each parent is set up under
+           its own savepoint; a failing parent keeps its error and is
+           skipped by later runs until the error is cleared.'''
+        auto_commit = not getattr(threading.currentThread(), 'testing', False)
+        last_id = 0
+        while True:
+            parents = self.search([('user_setup_pending', '=', True),
+                                   ('user_setup_error', '=', False),
+                                   ('id', '>', last_id)],
+                                  limit=batch_size, order='id')
+            if not parents:
+                break
+            for parent in parents:
+                try:
+                    with self.env.cr.savepoint():
+                        parent.user_ids.filtered(
+                            'email').action_reset_password()
+                        parent.user_setup_pending = False
+                except Exception as e:
+                    _logger.exception('Parent account setup failed for %s',
+                                      parent.id)
+                    parent.user_setup_error = str(e) or repr(e)
+            last_id = parents[-1].id
+            if auto_commit:
+                self.env.cr.commit()
+        return True
+
+    def action_retry_user_setup(self):
+        '''Clear the setup error so the scheduled job tries again'''
+        self.write({'user_setup_error': False})
+        return True
 
     @api.onchange('state_id')
     def onchange_state(self):
@@ -71,3 +136,182 @@ class SchoolParent(models.Model):
         self.country_id = False
         if self.state_id:
             self.country_id = self.state_id.country_id.id
+
+
+class SchoolParentImport(models.Model):
+    '''Bulk import of parents processed in batches by a scheduled job.'''
+
+    _name = 'school.parent.import'
+    _description = 'Importation des parents'
+    _order = 'id desc'
+
+    IMPORT_COLUMNS = ['name', 'email', 'phone', 'mobile', 'relation',
+                      'students']
+
+    @api.depends('line_ids.state')
+    def _compute_progress(self):
+        line_obj = self.env['school.parent.import.line']
+        counts = {}
+        if self.ids:
+            groups = line_obj.read_group([('import_id', 'in', self.ids)],
+                                         ['import_id', 'state'],
+                                         ['import_id', 'state'], lazy=False)
+            for group in groups:
+                key = (group['import_id'][0], group['state'])
+                counts[key] = group['__count']
+        for rec in self:
+            done = counts.get((rec.id, 'done'), 0)
+            failed = counts.get((rec.id, 'error'), 0)
+            pending = counts.get((rec.id, 'pending'), 0)
+            rec.total_lines = done + failed + pending
+            rec.done_lines = done
+            rec.failed_lines = failed
+            rec.progress = (rec.total_lines and
+                            100.0 * (done + failed) / rec.total_lines)
+
+    name = fields.Char('Nom', required=True,
+                       default=lambda self: fields.Datetime.now().strftime(
+                           'Import %Y-%m-%d %H:%M'))
+    import_file = fields.Binary('Fichier CSV', required=True,
+                                help="Colonnes: name, email, phone, mobile, \
+relation, students (PID séparés par ';')")
+    file_name = fields.Char('Nom de fichier')
+    batch_size = fields.Integer('Taille du lot', default=200, required=True)
+    state = fields.Selection([('draft', 'Draft'),
+                              ('running', 'Running'),
+                              ('done', 'Done')],
+                             'Statut', readonly=True, default='draft',
+                             index=True)
+    line_ids = fields.One2many('school.parent.import.line', 'import_id',
+                               'Lignes')
+    total_lines = fields.Integer('Total', compute='_compute_progress')
+    done_lines = fields.Integer('Importé', compute='_compute_progress')
+    failed_lines = fields.Integer('En erreur', compute='_compute_progress')
+    progress = fields.Float('Progression', compute='_compute_progress')
+
+    @api.constrains('batch_size')
+    def check_batch_size(self):
+        if any(rec.batch_size <= 0 for rec in self):
+            raise ValidationError(_('La taille du lot doit être supérieure \
+à 0!'))
+
+    def _read_rows(self):
+        '''Parse the uploaded CSV file into line values'''
+        self.ensure_one()
+        content = base64.b64decode(self.import_file or b'')
+        reader = csv.DictReader(io.StringIO(content.decode('utf-8-sig')))
+        missing = set(['name', 'email']) - set(reader.fieldnames or [])
+        if missing:
+            raise UserError(_('Colonnes manquantes dans le fichier: %s'
+                              ) % ', '.join(sorted(missing)))
+        for row in reader:
+            vals = {col: (row.get(col) or '').strip()
+                    for col in self.IMPORT_COLUMNS}
+            if vals['name'] or vals['email']:
+                yield vals
+
+    def action_start(self):
+        '''Stage the file lines and hand them over to the scheduled job'''
+        line_obj = self.env['school.parent.import.line']
+        for rec in self.filtered(lambda r: r.state == 'draft'):
+            line_obj.create([dict(vals, import_id=rec.id)
+                             for vals in rec._read_rows()])
+            rec.state = 'running'
+        return True
+
+    def action_process_batch(self):
+        '''Import the next batch of pending lines of each import'''
+        line_obj = self.env['school.parent.import.line']
+        for rec in self.filtered(lambda r: r.state == 'running'):
+            lines = line_obj.search([('import_id', '=', rec.id),
+                                     ('state', '=', 'pending')],
+                                    limit=rec.batch_size, order='id')
+            if lines:
+                lines._import_parents()
+            if len(lines) < rec.batch_size:
+                rec.state = 'done'
+        return True
+
+    @api.model
+    def _cron_process_imports(self):
+        '''Process running imports batch by batch, committing after each
+           batch so imported parents become usable right away.'''
+        auto_commit = not getattr(threading.currentThread(), 'testing', False)
+        imports = self.search([('state', '=', 'running')], order='id')
+        for rec in imports:
+            while rec.state == 'running':
+                rec.action_process_batch()
+                if auto_commit:
+                    self.env.cr.commit()
+        return True
+
+
+class SchoolParentImportLine(models.Model):
+    '''One parent row of a bulk import.'''
+
+    _name = 'school.parent.import.line'
+    _description = "Ligne d'importation des parents"
+    _order = 'id'
+
+    import_id = fields.Many2one('school.parent.import', 'Importation',
+                                required=True, ondelete='cascade',
+                                index=True)
+    name = fields.Char('Nom')
+    email = fields.Char('E-Mail')
+    phone = fields.Char('Téléphone')
+    mobile = fields.Char('Mobile')
+    relation = fields.Char('Relation')
+    students = fields.Char('Enfants (PID)')
+    state = fields.Selection([('pending', 'Pending'),
+                              ('done', 'Done'),
+                              ('error', 'Error')],
+                             'Statut', default='pending', index=True)
+    message = fields.Char('Message')
+    parent_id = fields.Many2one('school.parent', 'Parent')
+
+    def _prepare_parent_vals(self, students, relations):
+        self.ensure_one()
+        pids = [pid.strip() for pid in (self.students or '').split(';')
+                if pid.strip()]
+        return {'name': self.name,
+                'email': self.email,
+                'phone': self.phone,
+                'mobile': self.mobile,
+                'relation_id': relations.get((self.relation or '').lower()),
+                'student_id': [(6, 0, [students[pid] for pid in pids
+                                       if pid in students])]}
+
+    def _import_parents(self):
+        '''Create the parents of these lines in a single batch, falling back
+           to one savepoint per line to isolate failing rows.'''
+        parent_obj = self.env['school.parent'].with_context(
+            parent_defer_user_setup=True)
+        pids = set()
+        for line in self:
+            pids.update(pid.strip() for pid in (line.students or '').split(';')
+                        if pid.strip())
+        students = {}
+        if pids:
+            for student in self.env['student.student'].search_read(
+                    [('pid', 'in', list(pids))], ['pid']):
+                students[student['pid']] = student['id']
+        relations = {rel.name.lower(): rel.id for rel in
+                     self.env['parent.relation'].search([])}
+        vals_list = [line._prepare_parent_vals(students, relations)
+                     for line in self]
+        try:
+            with self.env.cr.savepoint():
+                parents = parent_obj.create(vals_list)
+        except Exception:
+            for line, vals in zip(self, vals_list):
+                try:
+                    with self.env.cr.savepoint():
+                        parent = parent_obj.create(vals)
+                    line.write({'state': 'done', 'parent_id': parent.id,
+                                'message': False})
+                except Exception as e:
+                    line.write({'state': 'error', 'message': str(e)[:250]})
+            return True
+        for line, parent in zip(self, parents):
+            line.write({'state': 'done', 'parent_id': parent.id})
+        return True
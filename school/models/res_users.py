@@ -1,25 +1,31 @@
 # See LICENSE file for full copyright and licensing details.
 
-from odoo import models, api
+from odoo import models, fields, api
 
 
 class ResUsers(models.Model):
 
     _inherit = "res.users"
 
-    @api.model
-    def create(self, vals):
+    news_unread_count = fields.Integer('Nouvelles non lues', default=-1,
+                                       copy=False, readonly=True,
+                                       help="Cache du nombre de nouvelles \
+adressées à l'utilisateur non lues, -1 lorsqu'il doit être recalculé.")
+
+    @api.model_create_multi
+    def create(self, vals_list):
         """Inherit Method to create user of group teacher or parent."""
-        vals.update({'employee_ids': False})
-        user_rec = super(ResUsers, self).create(vals)
+        for vals in vals_list:
+            vals.update({'employee_ids': False})
+        user_recs = super(ResUsers, self).create(vals_list)
         if self._context.get('teacher_create', False):
             teacher_grp_id = self.env.ref('school.group_school_teacher')
             user_base_grp = self.env.ref('base.group_user')
             contact_create = self.env.ref('base.group_partner_manager')
             teacher_group_ids = [user_base_grp.id, teacher_grp_id.id,
                                  contact_create.id]
-            user_rec.write({'groups_id': [(6, 0, teacher_group_ids)],
-                            'company_id': self._context.get('school_id'),
-                            'company_ids': [(4, self._context.get('school_id'))
-                                            ]})
-        return user_rec
+            user_recs.write({'groups_id': [(6, 0, teacher_group_ids)],
+                             'company_id': self._context.get('school_id'),
+                             'company_ids': [(4, self._context.get('school_id')
+                                              )]})
+        return user_recs
@@ -3,18 +3,54 @@
 # import time
 import re
 import calendar
+import logging
+import threading
+from collections import defaultdict
+from bisect import bisect_right
 from datetime import datetime
-from odoo import models, fields, api
+import psycopg2
+from odoo import models, fields, api, tools
 from odoo.tools.translate import _
-from odoo.tools import DEFAULT_SERVER_DATE_FORMAT
 from odoo.exceptions import except_orm
 from odoo.exceptions import ValidationError
 from dateutil.relativedelta import relativedelta
+from .elective import solve_allocation
+from .timetable import solve_timetable
 
+_logger = logging.getLogger(__name__)
+
+
+# Student fields of a class roster and the changes invalidating rosters
+ROSTER_FIELDS = ('id', 'roll_no', 'pid', 'student_code', 'gender')
+ROSTER_TRIGGERS = ('standard_id', 'school_id', 'division_id', 'medium_id',
+                   'state', 'active', 'roll_no', 'pid', 'student_code',
+                   'gender')
 
 EM = (r"[_a-z0-9-]+(\.[_a-z0-9-]+)*@[a-z0-9-]+(\.[a-z0-9-]+)*(\.[a-z]{2,4})$")
 
 
+def has_trigram(cr):
+    cr.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    return bool(cr.fetchone())
+
+
+def create_trigram_index(cr, indexname, tablename, column):
+    '''Create a pg_trgm GIN index serving ILIKE '%term%' on column,
+       installing the extension when possible. Return False when pg_trgm
+       is not available and searches fall back to sequential scans.'''
+    if not has_trigram(cr):
+        try:
+            with cr.savepoint():
+                cr.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        except psycopg2.Error:
+            _logger.warning('pg_trgm is not available, %s searches fall \
+back to sequential scans', tablename)
+            return False
+    cr.execute('CREATE INDEX IF NOT EXISTS "%s" ON "%s" USING gin ("%s" '
+               'gin_trgm_ops)' % (indexname, tablename, column))
+    return True
+
+
 def emailvalidation(email):
     """Check valid email."""
     if email:
@@ -46,6 +82,15 @@ class AcademicYear(models.Model):
     grade_id = fields.Many2one('grade.master', "Classe")
     current = fields.Boolean('Courant', help="Définir l'année en cours active")
     description = fields.Text('Description')
+    display_key = fields.Char("Nom d'affichage", compute='_compute_display_key',
+                              store=True, index=True)
+
+    @api.depends('code', 'name')
+    def _compute_display_key(self):
+        '''Store the displayed name so that many2one renderings and
+           name_search do not rebuild it'''
+        for rec in self:
+            rec.display_key = ' [%s]%s' % (rec.code or '', rec.name or '')
 
     @api.model
     def next_year(self, sequence):
@@ -58,7 +103,31 @@ class AcademicYear(models.Model):
 
     def name_get(self):
         '''Method to display name and code'''
-        return [(rec.id, ' [' + rec.code + ']' + rec.name) for rec in self]
+        return [(rec.id, rec.display_key) for rec in self]
+
+    @api.model
+    def _name_search(self, name, args=None, operator='ilike', limit=100,
+                     name_get_uid=None):
+        '''Search the code and name through the stored display key'''
+        args = list(args or [])
+        if name:
+            args += [('display_key', operator, name)]
+        ids = self._search(args, limit=limit, access_rights_uid=name_get_uid)
+        return models.lazy_name_get(self.browse(ids).with_user(name_get_uid))
+
+    def action_compute_results(self):
+        '''Compute the results of every class for these years'''
+        standards = self.env['school.standard'].search([])
+        for rec in self:
+            standards.compute_results(rec)
+        return True
+
+    def action_snapshot_history(self):
+        '''Record the year end history of the students of these years'''
+        history_obj = self.env['student.history']
+        for rec in self:
+            history_obj.snapshot_year(rec)
+        return True
 
     def generate_academicmonth(self):
         """Generate academic months."""
@@ -85,22 +154,31 @@ class AcademicYear(models.Model):
         '''Method to check start date should be greater than end date
            also check that dates are not overlapped with existing academic
            year'''
-        new_start_date = self.date_start
-        new_stop_date = self.date_stop
-        delta = new_stop_date - new_start_date
-        if delta.days > 365 and not calendar.isleap(new_start_date.year):
-            raise ValidationError(_('''Erreur! La durée de l'année académique
-                                       est invalide.'''))
-        if (self.date_stop and self.date_start and
-                self.date_stop < self.date_start):
-            raise ValidationError(_('''La date de début de l'année académique '
-                                       doit être inférieur à la date de fin.'''))
-        for old_ac in self.search([('id', 'not in', self.ids)]):
-            # Check start date should be less than stop date
-            if (old_ac.date_start <= self.date_start <= old_ac.date_stop or
-                    old_ac.date_start <= self.date_stop <= old_ac.date_stop):
-                raise ValidationError(_('''Erreur! Vous ne pouvez pas définir de chevauchement
-                                           années universitaires.'''))
+        errors = []
+        for rec in self:
+            delta = rec.date_stop - rec.date_start
+            if delta.days > 365 and not calendar.isleap(rec.date_start.year):
+                errors.append(_('''Erreur! La durée de l'année académique
+                                   %s est invalide.''') % rec.name)
+            if rec.date_stop < rec.date_start:
+                errors.append(_('''La date de début de l'année académique %s
+                                   doit être inférieur à la date de fin.'''
+                                ) % rec.name)
+        if self.ids:
+            # Check the years are not overlapped, in one query
+            self.flush(['date_start', 'date_stop'])
+            self._cr.execute("""SELECT DISTINCT new.name
+                                FROM academic_year new
+                                JOIN academic_year old
+                                  ON old.id != new.id
+                                 AND old.date_start <= new.date_stop
+                                 AND new.date_start <= old.date_stop
+                                WHERE new.id IN %s""", (tuple(self.ids),))
+            for name, in self._cr.fetchall():
+                errors.append(_('''Erreur! Vous ne pouvez pas définir de chevauchement
+                                   années universitaires (%s).''') % name)
+        if errors:
+            raise ValidationError('\n'.join(errors))
 
     @api.constrains('current')
     def check_current_year(self):
@@ -135,32 +213,44 @@ class AcademicMonth(models.Model):
     @api.constrains('date_start', 'date_stop')
     def _check_duration(self):
         '''Method to check duration of date'''
-        if (self.date_stop and self.date_start and
-                self.date_stop < self.date_start):
-            raise ValidationError(_(''' La date de fin de période doit être postérieure à la date de début de période!'''))
+        invalid = self.filtered(lambda rec: rec.date_stop and rec.date_start
+                                and rec.date_stop < rec.date_start)
+        if invalid:
+            raise ValidationError(_(''' La date de fin de période doit être postérieure à la date de début de période!''') +
+                                  '\n' + ', '.join(invalid.mapped('name')))
 
     @api.constrains('year_id', 'date_start', 'date_stop')
     def _check_year_limit(self):
         '''Method to check year limit'''
-        if self.year_id and self.date_start and self.date_stop:
-            if (self.year_id.date_stop < self.date_stop or
-                    self.year_id.date_stop < self.date_start or
-                    self.year_id.date_start > self.date_start or
-                    self.year_id.date_start > self.date_stop):
-                raise ValidationError(_('''Mois invalides! Quelques mois se chevauchent
+        invalid = self.filtered(
+            lambda rec: rec.year_id and rec.date_start and rec.date_stop and (
+                rec.year_id.date_stop < rec.date_stop or
+                rec.year_id.date_stop < rec.date_start or
+                rec.year_id.date_start > rec.date_start or
+                rec.year_id.date_start > rec.date_stop))
+        if invalid:
+            raise ValidationError(_('''Mois invalides! Quelques mois se chevauchent
                                      ou la période de date n'est pas dans le champ d'application
-                                     de l'année académique!'''))
+                                     de l'année académique!''') +
+                                  '\n' + ', '.join(invalid.mapped('name')))
 
     @api.constrains('date_start', 'date_stop')
     def check_months(self):
         """Check start date should be less than stop date."""
-        for old_month in self.search([('id', 'not in', self.ids)]):
-            if old_month.date_start <= \
-                    self.date_start <= old_month.date_stop \
-                    or old_month.date_start <= \
-                    self.date_stop <= old_month.date_stop:
-                raise ValidationError(_('''Erreur! Vous ne pouvez pas définir
-                     mois qui se chevauchent!'''))
+        if not self.ids:
+            return
+        self.flush(['date_start', 'date_stop'])
+        self._cr.execute("""SELECT DISTINCT new.code
+                            FROM academic_month new
+                            JOIN academic_month old
+                              ON old.id != new.id
+                             AND old.date_start <= new.date_stop
+                             AND new.date_start <= old.date_stop
+                            WHERE new.id IN %s""", (tuple(self.ids),))
+        codes = [code for code, in self._cr.fetchall()]
+        if codes:
+            raise ValidationError(_('''Erreur! Vous ne pouvez pas définir
+                     mois qui se chevauchent!''') + '\n' + ', '.join(codes))
 
 
 class StandardMedium(models.Model):
@@ -224,17 +314,105 @@ class SchoolStandard(models.Model):
         '''Compute student of done state'''
         student_obj = self.env['student.student']
         for rec in self:
-            rec.student_ids = student_obj.\
-                search([('standard_id', '=', rec.id),
-                        ('school_id', '=', rec.school_id.id),
-                        ('division_id', '=', rec.division_id.id),
-                        ('medium_id', '=', rec.medium_id.id),
-                        ('state', '=', 'done')])
-
-    @api.onchange('standard_id', 'division_id')
-    def onchange_combine(self):
-        self.name = str(self.standard_id.name
-                        ) + '-' + str(self.division_id.name)
+            rec.student_ids = student_obj.browse(
+                [row[0] for row in rec.sudo()._get_roster()])
+
+    def init(self):
+        '''Index walked by the sync API in (write_date, id) order and
+           trigram index of the search key when pg_trgm is available'''
+        tools.create_index(self._cr, 'school_standard_write_date_id_idx',
+                           self._table, ['write_date', 'id'])
+        create_trigram_index(self._cr, 'school_standard_search_key_trgm_idx',
+                             self._table, 'search_key')
+        # Classes created before the roster version was added start at 0
+        self._cr.execute("""UPDATE school_standard SET roster_version = 0
+                            WHERE roster_version IS NULL""")
+
+    @tools.ormcache('self.id', 'self.roster_version', 'self.env.uid',
+                    'self.env.su',
+                    "tuple(self._context.get('allowed_company_ids') or ())")
+    def _get_roster(self):
+        '''Admitted active students of the class ordered by roll number,
+           as tuples of ROSTER_FIELDS, restricted by the record rules of the
+           user unless in superuser mode. Cached per user and keyed on the
+           roster version of the class, which the student and class changes
+           affecting the roster increment. Reading the version for the key
+           costs a primary key lookup per call when it is not in the record
+           cache, instead of clearing the caches of the whole registry on
+           every student write.'''
+        self.flush(['school_id', 'division_id', 'medium_id'])
+        student_obj = self.env['student.student']
+        student_obj.flush(list(ROSTER_TRIGGERS))
+        rule_clause, params = 'TRUE', []
+        if not self.env.su:
+            query = student_obj._where_calc([], active_test=False)
+            student_obj._apply_ir_rules(query, 'read')
+            from_clause, where_clause, params = query.get_sql()
+            if where_clause:
+                rule_clause = """s.id IN (SELECT "student_student".id
+                                          FROM %s WHERE %s)""" % (
+                    from_clause, where_clause)
+        self._cr.execute("""SELECT s.id, s.roll_no, s.pid, s.student_code,
+                                   s.gender
+                            FROM student_student s
+                            JOIN school_standard c
+                              ON c.id = s.standard_id
+                             AND c.school_id = s.school_id
+                             AND c.division_id = s.division_id
+                             AND c.medium_id = s.medium_id
+                            WHERE c.id = %%s AND s.state = 'done' AND s.active
+                              AND %s
+                            ORDER BY s.roll_no, s.id""" % rule_clause,
+                         [self.id] + list(params))
+        return tuple(self._cr.fetchall())
+
+    def _bump_roster(self):
+        '''Renew the cached rosters of these classes on every worker'''
+        if not self:
+            return
+        self._cr.execute("""UPDATE school_standard
+                            SET roster_version =
+                                COALESCE(roster_version, 0) + 1
+                            WHERE id IN %s""", (tuple(self.ids),))
+        self.invalidate_cache(['roster_version'], self.ids)
+
+    def get_roster(self):
+        '''Return the roster of the class as a list of dicts of
+           ROSTER_FIELDS, without SQL once cached'''
+        self.ensure_one()
+        self.env['student.student'].check_access_rights('read')
+        return [dict(zip(ROSTER_FIELDS, row)) for row in self._get_roster()]
+
+    def get_roster_ids(self):
+        '''Return the ordered ids of the students of the class'''
+        self.ensure_one()
+        return [row[0] for row in self._get_roster()]
+
+    def write(self, vals):
+        res = super(SchoolStandard, self).write(vals)
+        if {'school_id', 'division_id', 'medium_id'} & set(vals):
+            self._bump_roster()
+        return res
+
+    @api.depends('standard_id.name', 'division_id.name')
+    def _compute_name(self):
+        '''Default the name of the class to standard-division'''
+        for rec in self:
+            rec.name = '%s-%s' % (rec.standard_id.name, rec.division_id.name)
+
+    @api.depends('standard_id.name', 'standard_id.code', 'division_id.name',
+                 'division_id.code', 'medium_id.code', 'school_id.code',
+                 'name')
+    def _compute_display_key(self):
+        '''Store the displayed name and the search key of the class'''
+        for rec in self:
+            rec.display_key = '%s[%s]' % (rec.standard_id.name,
+                                          rec.division_id.name)
+            values = [rec.name, rec.display_key, rec.standard_id.code,
+                      rec.division_id.code, rec.medium_id.code,
+                      rec.school_id.code]
+            rec.search_key = ' '.join(value for value in values
+                                      if value).lower()
 
     @api.depends('subject_ids')
     def _compute_subject(self):
@@ -265,6 +443,8 @@ class SchoolStandard(models.Model):
                                   'Étudiant en classe',
                                   compute='_compute_student', store=True
                                   )
+    roster_version = fields.Integer('Version de la liste', readonly=True,
+                                    copy=False, default=0)
     color = fields.Integer('Index de couleur')
     cmp_id = fields.Many2one('res.company', 'Raison sociale',
                              related='school_id.company_id', store=True)
@@ -272,7 +452,12 @@ class SchoolStandard(models.Model):
                                    'Syllabus')
     total_no_subjects = fields.Integer('Nombre total de sujets',
                                        compute="_compute_subject")
-    name = fields.Char('Nom')
+    name = fields.Char('Nom', compute='_compute_name', store=True,
+                       readonly=False)
+    display_key = fields.Char("Nom d'affichage", compute='_compute_display_key',
+                              store=True)
+    search_key = fields.Char('Clé de recherche', compute='_compute_display_key',
+                             store=True)
     capacity = fields.Integer("Nombre total de sièges")
     total_students = fields.Integer("Nombre total d'étudiants",
                                     compute="_compute_total_student",
@@ -285,18 +470,24 @@ class SchoolStandard(models.Model):
     @api.constrains('standard_id', 'division_id')
     def check_standard_unique(self):
         """Method to check unique standard."""
-        standard_search = self.env['school.standard'
-                                   ].search([('standard_id', '=',
-                                              self.standard_id.id),
-                                             ('division_id', '=',
-                                              self.division_id.id),
-                                             ('school_id', '=',
-                                              self.school_id.id),
-                                             ('id', 'not in', self.ids)])
-        if standard_search:
+        if not self.ids:
+            return
+        self.flush(['standard_id', 'division_id', 'school_id'])
+        self._cr.execute("""SELECT DISTINCT new.id
+                            FROM school_standard new
+                            JOIN school_standard old
+                              ON old.id != new.id
+                             AND old.school_id = new.school_id
+                             AND old.standard_id = new.standard_id
+                             AND old.division_id = new.division_id
+                            WHERE new.id IN %s""", (tuple(self.ids),))
+        duplicates = self.browse([row[0] for row in self._cr.fetchall()])
+        if duplicates:
             raise ValidationError(_('''La division et la classe doivent être uniques!'''
-                                    ))
-  
+                                    ) + '\n' + ', '.join(
+                                        name for _id, name in
+                                        duplicates.name_get()))
+
     def unlink(self):
         for rec in self:
             if rec.student_ids or rec.subject_ids or rec.syllabus_ids:
@@ -308,14 +499,131 @@ class SchoolStandard(models.Model):
     @api.constrains('capacity')
     def check_seats(self):
         """Method to check seats."""
-        if self.capacity <= 0:
+        invalid = self.filtered(lambda rec: rec.capacity <= 0)
+        if invalid:
             raise ValidationError(_('''Le nombre total de sièges doit être supérieur à
-                 0!'''))
+                 0!''') + '\n' + ', '.join(name for _id, name in
+                                           invalid.name_get()))
+
+    def get_parents(self):
+        '''Return the parents having a child in these classes'''
+        return self.env['school.parent'].search([('standard_id', 'in',
+                                                  self.ids)])
+
+    def compute_results(self, year=None):
+        '''Compute the weighted percentage, result, grade and rank of the
+           admitted students of these classes for an academic year.
+
+           Marks are loaded with one query, every class is computed in
+           memory and the results are written back with one UPDATE.'''
+        student_obj = self.env['student.student']
+        if year is None:
+            year = self.env['academic.year'].browse(
+                student_obj.check_current_year())
+        self.env['student.mark'].flush(['student_id', 'subject_id',
+                                        'year_id', 'marks'])
+        students = student_obj.search([('standard_id', 'in', self.ids),
+                                       ('state', '=', 'done'),
+                                       ('year', '=', year.id)])
+        if not students:
+            return 0
+        self._cr.execute("""SELECT student_id, subject_id, marks
+                            FROM student_mark
+                            WHERE year_id = %s AND student_id IN %s""",
+                         (year.id, tuple(students.ids)))
+        marks = {(stu_id, sub_id): value
+                 for stu_id, sub_id, value in self._cr.fetchall()}
+        class_students = {}
+        for student in students:
+            class_students.setdefault(student.standard_id.id,
+                                      []).append(student.id)
+        passed, failed = _('Réussi'), _('Échoué')
+        rows = []
+        for rec in self:
+            stu_ids = class_students.get(rec.id)
+            if not stu_ids or not rec.subject_ids:
+                continue
+            subjects = [(sub.id, sub.maximum_marks or 100.0,
+                         sub.minimum_marks, sub.weightage or 1)
+                        for sub in rec.subject_ids]
+            total_weight = float(sum(sub[3] for sub in subjects))
+            percentages, subject_fails = [], []
+            for stu_id in stu_ids:
+                score, fail = 0.0, False
+                for sub_id, maximum, minimum, weight in subjects:
+                    value = marks.get((stu_id, sub_id)) or 0.0
+                    score += value / maximum * weight
+                    fail = fail or value < minimum
+                percentages.append(round(score * 100 / total_weight, 2))
+                subject_fails.append(fail)
+            if year.grade_id:
+                grades, grade_fails = year.grade_id.get_grades(percentages)
+            else:
+                grades = grade_fails = [False] * len(stu_ids)
+            # Standard competition ranking, ties share the best rank
+            ranks, last, rank = {}, None, 0
+            order = sorted(range(len(stu_ids)), key=lambda i: -percentages[i])
+            for position, index in enumerate(order, 1):
+                if percentages[index] != last:
+                    rank, last = position, percentages[index]
+                ranks[index] = rank
+            for index, stu_id in enumerate(stu_ids):
+                fail = subject_fails[index] or grade_fails[index]
+                rows.append((stu_id, percentages[index],
+                             failed if fail else passed,
+                             grades[index] or None, ranks[index]))
+        if not rows:
+            return 0
+        student_obj.flush(['percentage', 'result', 'grade', 'rank'])
+        ids, percentages, results, grades, ranks = zip(*rows)
+        self._cr.execute("""UPDATE student_student s
+                            SET percentage = v.percentage,
+                                result = v.result,
+                                grade = v.grade,
+                                rank = v.rank,
+                                write_uid = %s,
+                                write_date = now() at time zone 'UTC'
+                            FROM unnest(%s::int[], %s::float8[],
+                                        %s::varchar[], %s::varchar[],
+                                        %s::int[])
+                                 AS v(id, percentage, result, grade, rank)
+                            WHERE s.id = v.id""",
+                         (self._uid, list(ids), list(percentages),
+                          list(results), list(grades), list(ranks)))
+        student_obj.invalidate_cache(['percentage', 'result', 'grade',
+                                      'rank', 'write_uid', 'write_date'],
+                                     list(ids))
+        return len(rows)
+
+    def action_compute_results(self):
+        '''Compute the results of the class for the current year'''
+        self.compute_results()
+        return True
+
+    def action_view_parents(self):
+        '''Open the parents of the class'''
+        action = self.env.ref('school.action_school_parent_form').read()[0]
+        action['domain'] = [('standard_id', 'in', self.ids)]
+        return action
 
     def name_get(self):
         '''Method to display standard and division'''
-        return [(rec.id, rec.standard_id.name + '[' + rec.division_id.name +
-                 ']') for rec in self]
+        return [(rec.id, rec.display_key) for rec in self]
+
+    @api.model
+    def _name_search(self, name, args=None, operator='ilike', limit=100,
+                     name_get_uid=None):
+        '''Match class names and standard, division, medium and school
+           codes in a single query on the search key, served by its trigram
+           index when pg_trgm is available'''
+        args = list(args or [])
+        if name:
+            if operator == 'ilike':
+                args += [('search_key', 'ilike', name)]
+            else:
+                args += [('display_key', operator, name)]
+        ids = self._search(args, limit=limit, access_rights_uid=name_get_uid)
+        return models.lazy_name_get(self.browse(ids).with_user(name_get_uid))
 
 
 class SchoolSchool(models.Model):
@@ -346,6 +654,272 @@ class SchoolSchool(models.Model):
                                  sera imprimé dans cette langue.
                                  Sinon, ce sera l'anglais.''')
     required_age = fields.Integer("Âge d'admission des étudiants requis", default=18)
+    archive_after_days = fields.Integer(
+        "Archiver après (jours)", default=730,
+        help="Les anciens élèves et étudiants résiliés depuis plus de jours \
+sont déplacés vers l'archive. 0 pour ne jamais archiver.")
+    timetable_days = fields.Integer('Jours par semaine', default=5,
+                                    help="Jours de cours de l'emploi du temps, \
+à partir du lundi.")
+    timetable_periods = fields.Integer('Périodes par jour', default=6)
+    timetable_line_ids = fields.One2many('school.timetable.line', 'school_id',
+                                         'Emploi du temps')
+    max_jobs = fields.Integer('Tâches simultanées', default=1,
+                              help="Nombre de tâches de fond de l'école \
+exécutées en même temps.")
+
+    @api.constrains('timetable_days', 'timetable_periods')
+    def check_timetable(self):
+        '''The week has at most 7 days and a day at least one period'''
+        invalid = self.filtered(lambda rec: not 0 < rec.timetable_days <= 7 or
+                                rec.timetable_periods <= 0)
+        if invalid:
+            raise ValidationError(_("L'emploi du temps doit avoir entre 1 et \
+7 jours et au moins une période par jour!") + '\n' + ', '.join(
+                invalid.mapped('name')))
+
+    def _timetable_slot(self, line):
+        return int(line.day) * self.timetable_periods + line.period - 1
+
+    def _timetable_line_vals(self, lesson):
+        standard_id, subject_id, teacher_id, room_id, slot = lesson
+        return {'school_id': self.id,
+                'standard_id': standard_id,
+                'subject_id': subject_id,
+                'teacher_id': teacher_id or False,
+                'room_id': room_id or False,
+                'day': str(slot // self.timetable_periods),
+                'period': slot % self.timetable_periods + 1}
+
+    def _schedule_timetable(self, kept_lines):
+        '''Schedule the missing weekly periods of the classes of the school
+           around kept_lines, which may be moved to make room. Return the
+           missing periods that could not be scheduled.'''
+        self.ensure_one()
+        line_obj = self.env['school.timetable.line']
+        standards = self.env['school.standard'].search([('school_id', '=',
+                                                         self.id)])
+        teachers = {}
+        scheduled = defaultdict(int)
+        for line in kept_lines:
+            scheduled[line.standard_id.id, line.subject_id.id] += 1
+            teachers[line.standard_id.id, line.subject_id.id] = \
+                line.teacher_id.id
+        groups = []
+        for standard in standards:
+            for subject in standard.subject_ids:
+                count = (subject.weekly_load -
+                         scheduled[standard.id, subject.id])
+                if count <= 0:
+                    continue
+                key = (standard.id, subject.id)
+                if teachers.get(key):
+                    candidates = [teachers[key]]
+                else:
+                    candidates = subject.teacher_ids.filtered(
+                        lambda teacher: not teacher.school_id or
+                        teacher.school_id == self).ids
+                groups.append((standard.id, subject.id, candidates,
+                               standard.class_room_id.id, count))
+        # Teachers and rooms shared with the other schools. Bookings clash
+        # on the same day and period number whatever the grid of the other
+        # school, as the slot constraints of the lines do, so they are
+        # mapped onto this grid and those outside of it are ignored.
+        teacher_ids = {teacher for group in groups for teacher in group[2]}
+        room_ids = {group[3] for group in groups if group[3]}
+        unavailable = []
+        for line in line_obj.search([('school_id', '!=', self.id), '|',
+                                     ('teacher_id', 'in', list(teacher_ids)),
+                                     ('room_id', 'in', list(room_ids))]):
+            if (int(line.day) >= self.timetable_days or
+                    line.period > self.timetable_periods):
+                continue
+            slot = self._timetable_slot(line)
+            if line.teacher_id:
+                unavailable.append(('teacher', line.teacher_id.id, slot))
+            if line.room_id:
+                unavailable.append(('room', line.room_id.id, slot))
+        existing = [(line.standard_id.id, line.subject_id.id,
+                     line.teacher_id.id, line.room_id.id,
+                     self._timetable_slot(line)) for line in kept_lines]
+        placed, unplaced, moved = solve_timetable(
+            groups, self.timetable_days, self.timetable_periods, existing,
+            unavailable)
+        moved_lines = line_obj.browse([kept_lines[index].id
+                                       for index in moved])
+        moved_lessons = [existing[index][:4] + (slot,)
+                         for index, slot in moved.items()]
+        # Delete before inserting so no transient double booking is seen
+        moved_lines.unlink()
+        line_obj.create([self._timetable_line_vals(lesson)
+                         for lesson in placed + moved_lessons])
+        return [{'standard_id': standard_id,
+                 'subject_id': subject_id,
+                 'missing': missing}
+                for standard_id, subject_id, missing in unplaced]
+
+    def generate_timetable(self):
+        '''Build the weekly timetable of every class of the schools from
+           the subjects of the classes, their weekly load and the teachers
+           of the subjects. Return the periods which could not be
+           scheduled, by school id.'''
+        res = {}
+        for rec in self:
+            rec.timetable_line_ids.unlink()
+            res[rec.id] = rec._schedule_timetable(
+                self.env['school.timetable.line'])
+        return res
+
+    def repair_timetable(self, teachers):
+        '''Reschedule the periods of teachers, e.g. after a change of
+           their subjects, keeping the rest of the timetable as much as
+           possible. Periods without teacher are rescheduled too.'''
+        res = {}
+        for rec in self:
+            lines = rec.timetable_line_ids
+            removed = lines.filtered(
+                lambda line: not line.teacher_id or line.teacher_id in teachers)
+            removed.unlink()
+            res[rec.id] = rec._schedule_timetable(lines - removed)
+        return res
+
+    def action_generate_timetable(self):
+        '''Button generating the timetable of the school'''
+        self.generate_timetable()
+        return True
+
+    def clone_structure(self, target, subjects=True, syllabus=True,
+                        dry_run=False):
+        '''Copy the classes of the school with their capacity and, when
+           asked, their subjects and syllabus rows into the target school.
+
+           Classes already in the target (same standard and division) are
+           kept and only get their missing subjects; rooms and class
+           teachers belong to a campus and are not copied. Rows are copied
+           by INSERT ... SELECT statements over an (old id, new id) map of
+           the classes, then the stored computed fields of the new classes
+           are recomputed in batch. With dry_run nothing is written.
+
+           Return the diff: the names of the classes created and of the
+           classes kept, the numbers of subject links and syllabus rows
+           added.'''
+        self.ensure_one()
+        target.ensure_one()
+        if target == self:
+            raise ValidationError(_("L'école cible doit être différente de \
+l'école source!"))
+        standard_obj = self.env['school.standard']
+        syllabus_obj = self.env['subject.syllabus']
+        standard_obj.check_access_rights('create')
+        if syllabus:
+            syllabus_obj.check_access_rights('create')
+        standard_obj.flush()
+        syllabus_obj.flush()
+        cr = self._cr
+        cr.execute("""SELECT src.id, dst.id FROM school_standard src
+                      LEFT JOIN school_standard dst
+                             ON dst.school_id = %s
+                            AND dst.standard_id = src.standard_id
+                            AND dst.division_id = src.division_id
+                      WHERE src.school_id = %s
+                      ORDER BY src.id""", (target.id, self.id))
+        pairs = cr.fetchall()
+        new_src = [src_id for src_id, dst_id in pairs if not dst_id]
+        kept = [dst_id for src_id, dst_id in pairs if dst_id]
+        new_ids = [0] * len(new_src)
+        if new_src and not dry_run:
+            cr.execute("""SELECT nextval('school_standard_id_seq')
+                          FROM generate_series(1, %s)""", (len(new_src),))
+            new_ids = [row[0] for row in cr.fetchall()]
+        # Classes to create then classes kept
+        class_map = (new_src + [src_id for src_id, dst_id in pairs if dst_id],
+                     new_ids + kept)
+        res = {'create': standard_obj.browse(new_src).mapped('name'),
+               'kept': standard_obj.browse(kept).mapped('name'),
+               'subjects': 0,
+               'syllabus': 0}
+        subject_query = """FROM subject_standards_rel r
+                           JOIN unnest(%s::int[], %s::int[])
+                                AS m(src_id, dst_id)
+                             ON r.subject_id = m.src_id
+                           WHERE NOT EXISTS (
+                               SELECT 1 FROM subject_standards_rel d
+                               WHERE d.subject_id = m.dst_id
+                                 AND d.standard_id = r.standard_id)"""
+        if syllabus and new_src:
+            cr.execute("""SELECT COUNT(*) FROM subject_syllabus
+                          WHERE standard_id IN %s""", (tuple(new_src),))
+            res['syllabus'] = cr.fetchone()[0]
+        if dry_run:
+            if subjects:
+                cr.execute("SELECT COUNT(*) " + subject_query, class_map)
+                res['subjects'] = cr.fetchone()[0]
+            return res
+        if new_src:
+            cr.execute("""INSERT INTO school_standard
+                              (id, school_id, standard_id, division_id,
+                               medium_id, capacity, color, roster_version,
+                               create_uid, create_date, write_uid,
+                               write_date)
+                          SELECT m.dst_id, %s, s.standard_id, s.division_id,
+                                 s.medium_id, s.capacity, s.color, 0,
+                                 %s, NOW() AT TIME ZONE 'UTC',
+                                 %s, NOW() AT TIME ZONE 'UTC'
+                          FROM unnest(%s::int[], %s::int[])
+                               AS m(src_id, dst_id)
+                          JOIN school_standard s ON s.id = m.src_id""",
+                       (target.id, self._uid, self._uid, new_src, new_ids))
+        if subjects:
+            cr.execute("""INSERT INTO subject_standards_rel
+                              (subject_id, standard_id)
+                          SELECT m.dst_id, r.standard_id """ + subject_query,
+                       class_map)
+            res['subjects'] = cr.rowcount
+        if syllabus and new_src:
+            # Syllabus rows get their ids first, so their documents can be
+            # attached to the copies in the same statement
+            cr.execute("""WITH src AS (
+                              SELECT y.id AS old_id, y.subject_id, m.dst_id,
+                                     nextval('subject_syllabus_id_seq')
+                                         AS new_id
+                              FROM subject_syllabus y
+                              JOIN unnest(%s::int[], %s::int[])
+                                   AS m(src_id, dst_id)
+                                ON y.standard_id = m.src_id
+                          ), syllabus AS (
+                              INSERT INTO subject_syllabus
+                                  (id, standard_id, subject_id, create_uid,
+                                   create_date, write_uid, write_date)
+                              SELECT new_id, dst_id, subject_id,
+                                     %s, NOW() AT TIME ZONE 'UTC',
+                                     %s, NOW() AT TIME ZONE 'UTC'
+                              FROM src
+                          )
+                          INSERT INTO ir_attachment
+                              (name, res_model, res_field, res_id, type,
+                               store_fname, db_datas, checksum, file_size,
+                               mimetype, index_content, public, create_uid,
+                               create_date, write_uid, write_date)
+                          SELECT a.name, a.res_model, a.res_field, src.new_id,
+                                 a.type, a.store_fname, a.db_datas,
+                                 a.checksum, a.file_size, a.mimetype,
+                                 a.index_content, a.public,
+                                 %s, NOW() AT TIME ZONE 'UTC',
+                                 %s, NOW() AT TIME ZONE 'UTC'
+                          FROM ir_attachment a
+                          JOIN src ON a.res_id = src.old_id
+                          WHERE a.res_model = 'subject.syllabus'
+                            AND a.res_field = 'syllabus_doc'""",
+                       (new_src, new_ids) + (self._uid,) * 4)
+        standard_obj.invalidate_cache()
+        syllabus_obj.invalidate_cache()
+        target.invalidate_cache(['standards'])
+        new_standards = standard_obj.browse(new_ids)
+        for field in standard_obj._fields.values():
+            if field.store and field.compute and field.type != 'one2many':
+                self.env.add_to_compute(field, new_standards)
+        new_standards.recompute()
+        return res
 
     @api.model
     def create(self, vals):
@@ -365,6 +939,9 @@ class SubjectSubject(models.Model):
     maximum_marks = fields.Integer("Notes maximales")
     minimum_marks = fields.Integer("Notes minimales")
     weightage = fields.Integer("WeightAge")
+    weekly_load = fields.Integer('Périodes par semaine', default=1,
+                                 help="Nombre de périodes hebdomadaires de la \
+matière dans l'emploi du temps des classes.")
     teacher_ids = fields.Many2many('school.teacher', 'subject_teacher_rel',
                                    'subject_id', 'teacher_id', 'Enseignants')
     standard_ids = fields.Many2many('standard.standard',
@@ -373,6 +950,8 @@ class SubjectSubject(models.Model):
     is_practical = fields.Boolean('Est pratique',
                                   help='Cochez ceci si le sujet est pratique.')
     elective_id = fields.Many2one('subject.elective')
+    elective_capacity = fields.Integer('Places', help="Nombre maximal \
+d'étudiants de la matière optionnelle, 0 pour illimité.")
     student_ids = fields.Many2many('student.student',
                                    'elective_subject_student_rel',
                                    'subject_id', 'student_id', 'Étudiants')
@@ -386,7 +965,7 @@ class SubjectSyllabus(models.Model):
 
     standard_id = fields.Many2one('school.standard', 'Standard')
     subject_id = fields.Many2one('subject.subject', 'Matière')
-    syllabus_doc = fields.Binary("Syllabus Doc",
+    syllabus_doc = fields.Binary("Syllabus Doc", attachment=True,
                                  help="Joindre le Syllabus lié au sujet")
 
 
@@ -398,6 +977,48 @@ class SubjectElective(models.Model):
     name = fields.Char("Nom")
     subject_ids = fields.One2many('subject.subject', 'elective_id',
                                   'Sujets électifs')
+    preference_ids = fields.One2many('subject.elective.preference',
+                                     'elective_id', 'Préférences')
+
+    def allocate_students(self):
+        '''Allocate the students of the elective groups from their ranked
+           preferences and the subject capacities. The subject members
+           are replaced by the allocation. Return the fill statistics of
+           each group and subject, by group id.'''
+        stats = {}
+        for rec in self:
+            preferences = {}
+            for pref in self.env['subject.elective.preference'].search_read(
+                    [('elective_id', '=', rec.id)],
+                    ['student_id', 'subject_id'],
+                    order='student_id, sequence, id'):
+                preferences.setdefault(pref['student_id'][0], []).append(
+                    pref['subject_id'][0])
+            capacities = {sub.id: sub.elective_capacity
+                          for sub in rec.subject_ids}
+            assigned = solve_allocation(preferences, capacities)
+            members = defaultdict(list)
+            for student_id, subject_id in assigned.items():
+                members[subject_id].append(student_id)
+            subject_stats = []
+            for subject in rec.subject_ids:
+                subject.write({'student_ids': [(6, 0, members[subject.id])]})
+                first_choice = len([stu_id for stu_id in members[subject.id]
+                                    if preferences[stu_id][0] == subject.id])
+                subject_stats.append({'subject_id': subject.id,
+                                      'name': subject.name,
+                                      'capacity': subject.elective_capacity,
+                                      'allocated': len(members[subject.id]),
+                                      'first_choice': first_choice})
+            stats[rec.id] = {'students': len(preferences),
+                             'unassigned': len(preferences) - len(assigned),
+                             'subjects': subject_stats}
+        return stats
+
+    def action_allocate_students(self):
+        '''Button allocating the students of the elective group'''
+        self.allocate_students()
+        return True
 
 
 class MotherTongue(models.Model):
@@ -444,7 +1065,7 @@ class StudentDocument(models.Model):
     doc_type = fields.Many2one('document.type', 'Type de document', required=True)
     file_name = fields.Char('Nom de fichier',)
     return_date = fields.Date('Date de retour')
-    new_datas = fields.Binary('Pièces jointes')
+    new_datas = fields.Binary('Pièces jointes', attachment=True)
 
 
 class DocumentType(models.Model):
@@ -497,12 +1118,98 @@ class StudentHistory(models.Model):
     _name = "student.history"
     _description = "Histoire des étudiants"
 
-    student_id = fields.Many2one('student.student', 'Étudiant')
+    student_id = fields.Many2one('student.student', 'Étudiant', index=True)
     academice_year_id = fields.Many2one('academic.year', 'Année académique',
-                                        )
+                                        index=True)
     standard_id = fields.Many2one('school.standard', 'Normes')
     percentage = fields.Float("Pourcentage", readonly=True)
     result = fields.Char('Résultat', readonly=True)
+    grade = fields.Char('Note', readonly=True)
+    rank = fields.Integer('Rang', readonly=True)
+
+    _sql_constraints = [
+        ('student_year_unique', 'unique(student_id, academice_year_id)',
+         "Un seul historique par étudiant et par année académique!"),
+    ]
+
+    @api.model
+    def snapshot_year(self, year, schools=None):
+        '''Copy the class, percentage and result of the students of an
+           academic year into their history, with one INSERT ... SELECT per
+           school. Running it again refreshes the rows of that year.'''
+        student_obj = self.env['student.student']
+        student_obj.flush(['year', 'school_id', 'standard_id', 'state',
+                           'percentage', 'result', 'grade', 'rank'])
+        if schools is None:
+            schools = self.env['school.school'].search([])
+        total = 0
+        for school_rec in schools:
+            self._cr.execute("""
+                INSERT INTO student_history
+                    (student_id, academice_year_id, standard_id, percentage,
+                     result, grade, rank, create_uid, create_date, write_uid,
+                     write_date)
+                SELECT s.id, s.year, s.standard_id, s.percentage, s.result,
+                       s.grade, s.rank, %(uid)s, now() at time zone 'UTC',
+                       %(uid)s, now() at time zone 'UTC'
+                FROM student_student s
+                WHERE s.year = %(year)s AND s.school_id = %(school)s
+                  AND s.state IN ('done', 'alumni')
+                ON CONFLICT (student_id, academice_year_id) DO UPDATE
+                SET standard_id = EXCLUDED.standard_id,
+                    percentage = EXCLUDED.percentage,
+                    result = EXCLUDED.result,
+                    grade = EXCLUDED.grade,
+                    rank = EXCLUDED.rank,
+                    write_uid = EXCLUDED.write_uid,
+                    write_date = EXCLUDED.write_date""",
+                             {'uid': self._uid, 'year': year.id,
+                              'school': school_rec.id})
+            total += self._cr.rowcount
+        self.invalidate_cache()
+        student_obj.invalidate_cache(['history_ids'])
+        return total
+
+
+class StudentMark(models.Model):
+    """Marks obtained by a student in a subject for an academic year."""
+
+    _name = "student.mark"
+    _description = "Notes des étudiants"
+    _rec_name = "subject_id"
+    _order = "year_id desc, standard_id, student_id, subject_id"
+
+    student_id = fields.Many2one('student.student', 'Étudiant', required=True,
+                                 index=True, ondelete='cascade')
+    standard_id = fields.Many2one('school.standard', 'Classe',
+                                  related='student_id.standard_id', store=True,
+                                  index=True, readonly=True)
+    subject_id = fields.Many2one('subject.subject', 'Matière', required=True)
+    year_id = fields.Many2one('academic.year', 'Année académique',
+                              required=True, index=True,
+                              default=lambda self: self.env[
+                                  'academic.year'].search(
+                                      [('current', '=', True)], limit=1))
+    marks = fields.Float('Notes obtenues')
+
+    _sql_constraints = [
+        ('student_subject_year_unique',
+         'unique(student_id, subject_id, year_id)',
+         "Une seule note par étudiant, matière et année académique!"),
+    ]
+
+    @api.constrains('marks', 'subject_id')
+    def check_marks(self):
+        '''Marks can not exceed the maximum marks of the subject'''
+        invalid = self.filtered(
+            lambda rec: rec.marks < 0 or (rec.subject_id.maximum_marks and
+                                          rec.marks >
+                                          rec.subject_id.maximum_marks))
+        if invalid:
+            raise ValidationError(_("Les notes doivent être comprises entre \
+0 et les notes maximales de la matière!") + '\n' + ', '.join(
+                '%s (%s)' % (rec.student_id.name, rec.subject_id.name)
+                for rec in invalid))
 
 
 class StudentCertificate(models.Model):
@@ -513,7 +1220,7 @@ class StudentCertificate(models.Model):
 
     student_id = fields.Many2one('student.student', 'Étudiant')
     description = fields.Char('Description')
-    certi = fields.Binary('Certificat', required=True)
+    certi = fields.Binary('Certificat', required=True, attachment=True)
 
 
 class StudentReference(models.Model):
@@ -547,15 +1254,24 @@ class StudentPreviousSchool(models.Model):
 
     @api.constrains('admission_date', 'exit_date')
     def check_date(self):
-        curr_dt = datetime.now()
-        new_dt = datetime.strftime(curr_dt,
-                                   DEFAULT_SERVER_DATE_FORMAT)
-        if self.admission_date >= new_dt or self.exit_date >= new_dt:
-            raise ValidationError(_('''Votre date d'admission et date de sortie
-             devrait être inférieur à la date actuelle dans les détails de l'école précédente!'''))
-        if self.admission_date > self.exit_date:
-            raise ValidationError(_(''' La date d'admission doit être inférieure à
-             date de sortie à l'école précédente!'''))
+        today = fields.Date.today()
+        future = self.filtered(
+            lambda rec: (rec.admission_date and rec.admission_date >= today) or
+            (rec.exit_date and rec.exit_date >= today))
+        reversed_dates = self.filtered(
+            lambda rec: rec.admission_date and rec.exit_date and
+            rec.admission_date > rec.exit_date)
+        errors = []
+        if future:
+            errors.append(_('''Votre date d'admission et date de sortie
+             devrait être inférieur à la date actuelle dans les détails de l'école précédente!''') +
+                          ' (%s)' % ', '.join(future.mapped('name')))
+        if reversed_dates:
+            errors.append(_(''' La date d'admission doit être inférieure à
+             date de sortie à l'école précédente!''') +
+                          ' (%s)' % ', '.join(reversed_dates.mapped('name')))
+        if errors:
+            raise ValidationError('\n'.join(errors))
 
 
 class AcademicSubject(models.Model):
@@ -616,6 +1332,67 @@ class GradeMaster(models.Model):
 
     name = fields.Char('Note', required=True)
     grade_ids = fields.One2many('grade.line', 'grade_id', 'Lignes de grade')
+    version = fields.Integer('Version', readonly=True, copy=False, default=0,
+                             help="Incrémentée à chaque modification des \
+lignes, elle renouvelle la table des notes en cache.")
+
+    def init(self):
+        '''Grades created before the version was added start at 0'''
+        self._cr.execute("""UPDATE grade_master SET version = 0
+                            WHERE version IS NULL""")
+
+    @api.constrains('grade_ids')
+    def check_grade_ranges(self):
+        '''Grade lines must cover consecutive mark ranges'''
+        errors = []
+        for rec in self:
+            lines = rec.grade_ids.sorted('from_mark')
+            for prev, line in zip(lines, lines[1:]):
+                if line.from_mark <= prev.to_mark:
+                    errors.append(_('%s : les notes %s et %s se \
+chevauchent') % (rec.name, prev.grade, line.grade))
+                elif line.from_mark > prev.to_mark + 1:
+                    errors.append(_('%s : aucune note entre %s et %s') % (
+                        rec.name, prev.to_mark, line.from_mark))
+        if errors:
+            raise ValidationError('\n'.join(errors))
+
+    @tools.ormcache('self.id', 'self.version')
+    def _get_grade_table(self):
+        '''Sorted interval table of the grade lines: lower bounds, upper
+           bound of the last line, grades and fail flags. Keyed on the
+           version, so a line change only renews the table of its grade on
+           every worker instead of clearing the caches of the registry.'''
+        lines = self.grade_ids.sorted('from_mark')
+        return (tuple(lines.mapped('from_mark')),
+                lines[-1:].to_mark if lines else None,
+                tuple(lines.mapped('grade')),
+                tuple(line.fail for line in lines))
+
+    def get_grades(self, marks):
+        '''Return the grades and fail flags of a list of marks, with
+           False for marks outside of the grade ranges'''
+        self.ensure_one()
+        starts, stop, grades, fails = self._get_grade_table()
+        res_grades, res_fails = [], []
+        for mark in marks:
+            index = bisect_right(starts, mark) - 1 if mark is not None else -1
+            if index < 0 or mark > stop:
+                res_grades.append(False)
+                res_fails.append(False)
+            else:
+                res_grades.append(grades[index])
+                res_fails.append(fails[index])
+        return res_grades, res_fails
+
+    def _bump_version(self):
+        '''Renew the cached grade tables after a change of their lines'''
+        if not self:
+            return
+        self._cr.execute("""UPDATE grade_master
+                            SET version = COALESCE(version, 0) + 1
+                            WHERE id IN %s""", (tuple(self.ids),))
+        self.invalidate_cache(['version'], self.ids)
 
 
 class GradeLine(models.Model):
@@ -636,6 +1413,35 @@ class GradeLine(models.Model):
     grade_id = fields.Many2one("grade.master", 'Note Ref.')
     name = fields.Char('Nom')
 
+    @api.constrains('from_mark', 'to_mark')
+    def check_marks(self):
+        '''The range of a grade line can not be empty'''
+        invalid = self.filtered(lambda line: line.from_mark > line.to_mark)
+        if invalid:
+            raise ValidationError(_('La note de départ doit être inférieure \
+à la note de fin!') + '\n' + ', '.join(invalid.mapped('grade')))
+
+    @api.constrains('grade_id', 'from_mark', 'to_mark')
+    def check_grade_line_ranges(self):
+        '''Lines edited on their own must keep their grade consistent'''
+        self.mapped('grade_id').check_grade_ranges()
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super(GradeLine, self).create(vals_list)
+        res.mapped('grade_id')._bump_version()
+        return res
+
+    def write(self, vals):
+        grades = self.mapped('grade_id')
+        res = super(GradeLine, self).write(vals)
+        (grades | self.mapped('grade_id'))._bump_version()
+        return res
+
+    def unlink(self):
+        self.mapped('grade_id')._bump_version()
+        return super(GradeLine, self).unlink()
+
 
 class StudentNews(models.Model):
     """Defining studen news."""
@@ -653,20 +1459,152 @@ class StudentNews(models.Model):
                                 'Nouvelles des utilisateurs',
                                 help='Nom à qui cette nouvelle est liée.')
     color = fields.Integer('Index coleur', default=0)
+    read_user_ids = fields.Many2many('res.users', 'student_news_read_rel',
+                                     'news_id', 'user_id', 'Lu par',
+                                     readonly=True, copy=False)
+
+    def init(self):
+        '''Indexes backing the per-user feed and its keyset pagination'''
+        tools.create_index(self._cr, 'user_news_rel_user_news_idx',
+                           'user_news_rel', ['user_ids', 'id'])
+        tools.create_index(self._cr, 'student_news_read_rel_user_news_idx',
+                           'student_news_read_rel', ['user_id', 'news_id'])
+        tools.create_index(self._cr, 'student_news_date_id_idx',
+                           self._table, ['date DESC', 'id DESC'])
+
+    @api.model
+    def _feed_domain(self):
+        '''News addressed to the current user or to everybody'''
+        return ['|', ('user_ids', 'in', [self._uid]),
+                ('user_ids', '=', False), ('date', '!=', False)]
+
+    @api.model
+    def _invalidate_unread_count(self, user_ids):
+        '''Mark the cached unread counters of user_ids as stale'''
+        if user_ids:
+            self._cr.execute("""UPDATE res_users SET news_unread_count = -1
+                                WHERE id IN %s AND news_unread_count != -1""",
+                             (tuple(user_ids),))
+        self.env['res.users'].invalidate_cache(['news_unread_count'])
+
+    @api.model
+    def get_unread_count(self):
+        '''Return the number of unread news of the current user.
+
+           The unread news addressed to the user are counted once and cached
+           on the user until a post to the user invalidates it. News sent to
+           everybody are counted on each call, so a broadcast never writes
+           the row of every user.'''
+        unread = [('date', '!=', False),
+                  ('read_user_ids', 'not in', [self._uid])]
+        self._cr.execute("""SELECT news_unread_count FROM res_users
+                            WHERE id = %s""", (self._uid,))
+        row = self._cr.fetchone()
+        count = row and row[0]
+        if count is None or count < 0:
+            count = self.search_count([('user_ids', 'in', [self._uid])] +
+                                      unread)
+            self._cr.execute("""UPDATE res_users SET news_unread_count = %s
+                                WHERE id = %s""", (count, self._uid))
+            self.env['res.users'].invalidate_cache(['news_unread_count'],
+                                                   [self._uid])
+        return count + self.search_count([('user_ids', '=', False)] + unread)
+
+    @api.model
+    def get_feed(self, limit=20, cursor=None):
+        '''Return a page of the current user's news, newest first.
+
+           Pagination is keyset based on (date, id): pass the returned
+           `next_cursor` to get the following page.'''
+        domain = self._feed_domain()
+        if cursor:
+            date, news_id = fields.Datetime.to_datetime(cursor[0]), cursor[1]
+            domain += ['|', ('date', '<', date),
+                       '&', ('date', '=', date), ('id', '<', news_id)]
+        news = self.search(domain, limit=limit, order='date desc, id desc')
+        read_ids = set()
+        if news:
+            self._cr.execute("""SELECT news_id FROM student_news_read_rel
+                                WHERE user_id = %s AND news_id IN %s""",
+                             (self._uid, tuple(news.ids)))
+            read_ids = {row[0] for row in self._cr.fetchall()}
+        items = [{'id': rec['id'],
+                  'subject': rec['subject'],
+                  'description': rec['description'],
+                  'date': fields.Datetime.to_string(rec['date']),
+                  'read': rec['id'] in read_ids}
+                 for rec in news.read(['subject', 'description', 'date'])]
+        next_cursor = False
+        if len(news) == limit:
+            next_cursor = [items[-1]['date'], items[-1]['id']]
+        return {'news': items,
+                'next_cursor': next_cursor,
+                'unread_count': self.get_unread_count()}
+
+    def mark_read(self):
+        '''Mark the news as read by the current user'''
+        if not self:
+            return True
+        self.check_access_rule('read')
+        self._cr.execute("""INSERT INTO student_news_read_rel (news_id, user_id)
+                            SELECT id, %s FROM student_news WHERE id IN %s
+                            ON CONFLICT DO NOTHING""",
+                         (self._uid, tuple(self.ids)))
+        if self._cr.rowcount:
+            self._invalidate_unread_count([self._uid])
+        self.invalidate_cache(['read_user_ids'], self.ids)
+        return True
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        news = super(StudentNews, self).create(vals_list)
+        news._invalidate_feed_users()
+        return news
+
+    def write(self, vals):
+        if 'user_ids' in vals or 'date' in vals:
+            self._invalidate_feed_users()
+            res = super(StudentNews, self).write(vals)
+            self._invalidate_feed_users()
+            return res
+        return super(StudentNews, self).write(vals)
+
+    def unlink(self):
+        self._invalidate_feed_users()
+        return super(StudentNews, self).unlink()
+
+    def _invalidate_feed_users(self):
+        '''Invalidate the counters of the users these news are addressed
+           to; news sent to everybody are not cached'''
+        if not self:
+            return
+        self.flush(['user_ids'])
+        self._cr.execute("""SELECT DISTINCT user_ids FROM user_news_rel
+                            WHERE id IN %s""", (tuple(self.ids),))
+        self._invalidate_unread_count([row[0] for row in
+                                       self._cr.fetchall()])
 
     @api.constrains("date")
     def checknews_dates(self):
         """Check news date."""
         new_date = datetime.now()
-        if self.date < new_date:
+        expired = self.filtered(lambda rec: rec.date and rec.date < new_date)
+        if expired:
             raise ValidationError(_('''Configurer la date d'expiration supérieure à \ la
-date actuelle!'''))
+date actuelle!''') + '\n' + ', '.join(expired.mapped('subject')))
 
     def news_update(self):
+        '''Send the news by email from a background job'''
+        jobs = self.env['school.job'].enqueue(
+            self, '_send_news_update', _('Envoi des actualités'),
+            chunk_size=1)
+        return jobs.action_view_jobs()
+
+    def _send_news_update(self):
         '''Method to send email to student for news update'''
         emp_obj = self.env['hr.employee']
         obj_mail_server = self.env['ir.mail_server']
-        user = self.env['res.users'].browse(self._context.get('uid'))
+        user = self.env.user
         # Check if out going mail configured
         mail_server_ids = obj_mail_server.search([])
         if not mail_server_ids:
@@ -731,15 +1669,106 @@ class StudentReminder(models.Model):
     @api.model
     def check_user(self):
         '''Method to get default value of logged in Student'''
+        if not self.env.user.has_group('school.group_school_student'):
+            return False
         return self.env['student.student'].search([('user_id', '=',
-                                                    self._uid)]).id
+                                                    self._uid)],
+                                                  limit=1).id
 
     stu_id = fields.Many2one('student.student', "Nom d'étudiant", required=True,
-                             default=check_user)
+                             default=check_user, index=True)
     name = fields.Char('Titre')
-    date = fields.Date('Date')
+    date = fields.Date('Date', index=True)
     description = fields.Text('Description')
     color = fields.Integer('Index couleur', default=0)
+    active = fields.Boolean(default=True)
+    digest_sent = fields.Boolean('Envoyé dans le résumé', readonly=True,
+                                 copy=False, default=False)
+
+    def _auto_init(self):
+        '''Reminders already due when the flag is added are not sent'''
+        new = not tools.column_exists(self._cr, self._table, 'digest_sent')
+        res = super(StudentReminder, self)._auto_init()
+        if new:
+            self._cr.execute("""UPDATE student_reminder
+                                SET digest_sent = COALESCE(
+                                    date < CURRENT_DATE, FALSE)""")
+        return res
+
+    def init(self):
+        '''Index of the reminders left to the digest, in (date, student)
+           order'''
+        self._cr.execute("""CREATE INDEX IF NOT EXISTS
+                              student_reminder_digest_pending_idx
+                            ON student_reminder (date, stu_id, id)
+                            WHERE NOT digest_sent""")
+
+    @api.model
+    def _prepare_digest_mail(self, student, reminders):
+        '''Values of the digest mail sent to a student for one day'''
+        items = ''.join('<li><b>%s</b> %s</li>' % (
+            tools.html_escape(rem['name'] or ''),
+            tools.html_escape(rem['description'] or ''))
+            for rem in reminders)
+        date = reminders[0]['date'].strftime('%d-%m-%Y')
+        return {'subject': _('Rappels du %s') % date,
+                'body_html': '<p>%s</p><ul>%s</ul>' % (
+                    _('Bonjour %s, voici vos rappels du %s :'
+                      ) % (tools.html_escape(student.name), date), items),
+                'recipient_ids': [(4, student.partner_id.id)],
+                'email_from': (student.school_id.company_id.email or
+                               self.env.user.company_id.email),
+                'auto_delete': True}
+
+    @api.model
+    def _cron_send_digest(self, batch_size=1000):
+        '''Send one mail per student and per day listing the due reminders
+           not sent yet. Reminders are walked by chunks of (date, student)
+           groups in index order and flagged as sent with each chunk, so a
+           run resumes where the previous one stopped and a reminder added
+           or backdated later is sent by the next run.'''
+        auto_commit = not getattr(threading.currentThread(), 'testing', False)
+        student_obj = self.env['student.student']
+        mail_obj = self.env['mail.mail'].sudo()
+        today = fields.Date.context_today(self)
+        self.flush(['date', 'stu_id', 'active', 'digest_sent'])
+        cr = self._cr
+        while True:
+            cr.execute("""SELECT date, stu_id FROM student_reminder
+                          WHERE active AND NOT digest_sent AND date <= %s
+                          GROUP BY date, stu_id
+                          ORDER BY date, stu_id
+                          LIMIT %s""", (today, batch_size))
+            keys = cr.fetchall()
+            if not keys:
+                break
+            cr.execute("""UPDATE student_reminder SET digest_sent = TRUE
+                          WHERE active AND NOT digest_sent
+                            AND (date, stu_id) >= (%s, %s)
+                            AND (date, stu_id) <= (%s, %s)
+                          RETURNING id, stu_id, date, name, description""",
+                       keys[0] + keys[-1])
+            groups = {}
+            for rem in cr.dictfetchall():
+                groups.setdefault((rem['date'], rem['stu_id']), []).append(rem)
+            students = student_obj.browse({key[1] for key in keys}).exists()
+            students.mapped('partner_id.email')
+            vals_list = []
+            for (date, stu_id), reminders in sorted(groups.items()):
+                reminders.sort(key=lambda rem: rem['id'])
+                student = students.browse(stu_id)
+                if stu_id in students.ids and student.partner_id.email:
+                    vals_list.append(self._prepare_digest_mail(student,
+                                                               reminders))
+            if vals_list:
+                mail_obj.create(vals_list)
+            self.invalidate_cache(['digest_sent'])
+            if auto_commit:
+                cr.commit()
+            students.invalidate_cache()
+            if len(keys) < batch_size:
+                break
+        return True
 
 
 class StudentCast(models.Model):
@@ -0,0 +1,215 @@
+# See LICENSE file for full copyright and licensing details.
+
+import json
+import logging
+import threading
+import time
+import traceback
+from collections import defaultdict
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+# First keys of the advisory locks held on a job and on the job slots of
+# a school, the second key being the job or school id
+JOB_LOCK = 570001
+SLOT_LOCK = 570100
+
+
+class SchoolJob(models.Model):
+    '''Long batch operation run by chunks from the scheduler.
+
+       A job calls `method` of `model` on its records chunk by chunk, each
+       chunk in its own transaction committed together with the position
+       reached, so a crashed or interrupted job resumes after the last
+       committed chunk. A worker holds a session advisory lock on the job
+       while running it, released by PostgreSQL if the worker dies, and
+       one of the `max_jobs` slots of the school of the job.
+
+       Chunks run as the user who created the job, with `school_job` set
+       in the context and the job id and position of the chunk in
+       `school_job_id` and `school_job_offset`.'''
+
+    _name = 'school.job'
+    _description = 'Tâche de fond'
+    _order = 'id desc'
+
+    name = fields.Char('Nom', required=True, readonly=True)
+    school_id = fields.Many2one('school.school', 'École', readonly=True,
+                                index=True, ondelete='cascade')
+    user_id = fields.Many2one('res.users', 'Utilisateur', readonly=True,
+                              required=True, default=lambda self: self.env.uid)
+    model = fields.Char('Modèle', required=True, readonly=True)
+    method = fields.Char('Méthode', required=True, readonly=True)
+    record_ids = fields.Text('Enregistrements', readonly=True, default='[]')
+    args = fields.Text('Arguments', readonly=True, default='{}')
+    finish_model = fields.Char('Modèle de fin', readonly=True)
+    finish_method = fields.Char('Méthode de fin', readonly=True,
+                                help="Appelée une fois tous les blocs "
+                                     "traités.")
+    chunk_size = fields.Integer('Taille des blocs', default=100)
+    total = fields.Integer('Total', readonly=True)
+    position = fields.Integer('Traités', readonly=True, default=0)
+    progress = fields.Float('Progression', compute='_compute_progress')
+    state = fields.Selection([('pending', 'En attente'),
+                              ('running', 'En cours'),
+                              ('done', 'Terminée'),
+                              ('failed', 'Échec'),
+                              ('cancel', 'Annulée')], 'Statut',
+                             default='pending', readonly=True, index=True)
+    date_start = fields.Datetime('Début', readonly=True)
+    date_end = fields.Datetime('Fin', readonly=True)
+    error = fields.Text('Erreur', readonly=True)
+    attachment_ids = fields.One2many('ir.attachment', 'res_id', 'Documents',
+                                     domain=[('res_model', '=', 'school.job')],
+                                     readonly=True)
+
+    @api.depends('position', 'total')
+    def _compute_progress(self):
+        for rec in self:
+            rec.progress = (100.0 * rec.position / rec.total if rec.total
+                            else 100.0 * (rec.state == 'done'))
+
+    @api.model
+    def enqueue(self, records, method, name, kwargs=None, chunk_size=100,
+                finish=None):
+        '''Create the jobs calling method with kwargs on records by
+           chunks, one job per school when records belong to schools.
+           finish is an optional (model, method) called once done.'''
+        groups = defaultdict(list)
+        by_school = 'school_id' in records._fields
+        for rec in records:
+            groups[by_school and rec.school_id.id].append(rec.id)
+        finish_model, finish_method = finish or (False, False)
+        return self.sudo().create([{
+            'name': name,
+            'school_id': school_id or False,
+            'user_id': self.env.uid,
+            'model': records._name,
+            'method': method,
+            'record_ids': json.dumps(ids),
+            'args': json.dumps(kwargs or {}),
+            'finish_model': finish_model,
+            'finish_method': finish_method,
+            'chunk_size': chunk_size,
+            'total': len(ids)} for school_id, ids in groups.items()])
+
+    def action_view_jobs(self):
+        '''Open the jobs, to follow their progress'''
+        action = self.env.ref('school.action_school_job').read()[0]
+        if len(self) == 1:
+            action.update({'view_mode': 'form', 'res_id': self.id,
+                           'views': [(False, 'form')]})
+        else:
+            action['domain'] = [('id', 'in', self.ids)]
+        return action
+
+    def action_retry(self):
+        '''Resume failed jobs from their last committed chunk'''
+        self.filtered(lambda job: job.state == 'failed').write(
+            {'state': 'pending', 'error': False})
+        return True
+
+    def action_cancel(self):
+        if self.filtered(lambda job: job.state == 'done'):
+            raise UserError(_("Une tâche terminée ne peut pas être \
+annulée."))
+        self.write({'state': 'cancel', 'date_end': fields.Datetime.now()})
+        return True
+
+    def _try_lock(self):
+        '''Lock the job and a slot of its school for this worker session.
+           Return the slot, None when the job or the slots are taken.'''
+        cr = self._cr
+        cr.execute('SELECT pg_try_advisory_lock(%s, %s)', (JOB_LOCK, self.id))
+        if not cr.fetchone()[0]:
+            return None
+        for slot in range(max(self.school_id.max_jobs, 1)):
+            cr.execute('SELECT pg_try_advisory_lock(%s, %s)',
+                       (SLOT_LOCK + slot, self.school_id.id or 0))
+            if cr.fetchone()[0]:
+                return slot
+        cr.execute('SELECT pg_advisory_unlock(%s, %s)', (JOB_LOCK, self.id))
+        return None
+
+    def _unlock(self, slot):
+        self._cr.execute('SELECT pg_advisory_unlock(%s, %s), '
+                         'pg_advisory_unlock(%s, %s)',
+                         (SLOT_LOCK + slot, self.school_id.id or 0,
+                          JOB_LOCK, self.id))
+
+    def _run(self, deadline, auto_commit=True):
+        '''Process the chunks of the job until it ends or deadline'''
+        self.ensure_one()
+        ids = json.loads(self.record_ids)
+        kwargs = json.loads(self.args or '{}')
+        model = self.env[self.model].with_user(self.user_id)
+        if self.state == 'pending':
+            self.write({'state': 'running',
+                        'date_start': self.date_start or
+                        fields.Datetime.now()})
+        while True:
+            # Cancelled from the interface since the last chunk
+            self.invalidate_cache(['state'])
+            if self.state == 'cancel' or time.time() > deadline:
+                return False
+            position = self.position
+            chunk = ids[position:position + self.chunk_size]
+            if chunk:
+                records = model.with_context(
+                    school_job=True, school_job_id=self.id,
+                    school_job_offset=position).browse(chunk).exists()
+                method = self.method
+            elif self.finish_model and self.finish_method:
+                records = self.env[self.finish_model].with_user(self.user_id)
+                method, kwargs = self.finish_method, {}
+            else:
+                break
+            try:
+                with self._cr.savepoint():
+                    getattr(records, method)(**kwargs)
+                    records.flush()
+            except Exception:
+                self.env.clear()
+                _logger.exception('School job %s failed at %s', self.id,
+                                  position)
+                self.write({'state': 'failed',
+                            'error': traceback.format_exc(),
+                            'date_end': fields.Datetime.now()})
+                if auto_commit:
+                    self._cr.commit()
+                return False
+            if not chunk:
+                break
+            # The checkpoint is committed with the chunk
+            self.write({'position': position + len(chunk)})
+            if auto_commit:
+                self._cr.commit()
+        self.write({'state': 'done', 'date_end': fields.Datetime.now()})
+        if auto_commit:
+            self._cr.commit()
+        return True
+
+    @api.model
+    def _cron_run_jobs(self, time_limit=240):
+        '''Run the pending jobs and resume the interrupted ones, oldest
+           first, for at most time_limit seconds'''
+        auto_commit = not getattr(threading.currentThread(), 'testing', False)
+        deadline = time.time() + time_limit
+        for job in self.search([('state', 'in', ('pending', 'running'))],
+                               order='id'):
+            if time.time() > deadline:
+                break
+            slot = job._try_lock()
+            if slot is None:
+                continue
+            try:
+                # Another worker may have run it since the search
+                job.invalidate_cache(['state', 'position'])
+                if job.state in ('pending', 'running'):
+                    job._run(deadline, auto_commit)
+            finally:
+                job._unlock(slot)
+        return True
@@ -0,0 +1,162 @@
+# See LICENSE file for full copyright and licensing details.
+
+import threading
+from datetime import datetime
+
+from odoo import models, fields, api, _
+from odoo.exceptions import ValidationError
+
+
+class SchoolSequence(models.Model):
+    '''Per school counter handing out student identifiers.
+
+       In `gapless` mode the counter row of the school is incremented in the
+       current transaction, so numbers are consecutive but concurrent
+       admissions of the same school wait on each other. In `fast` mode each
+       worker reserves a block of numbers in a short separate transaction and
+       serves it from memory: no lock is held during admissions, at the cost
+       of gaps when a worker stops with an unused block.'''
+
+    _name = 'school.sequence'
+    _description = "Séquence d'identifiants scolaires"
+    _order = 'school_id, code'
+
+    # (dbname, sequence id) -> [next number, stop, write date of the counter
+    # when the block was reserved], shared by the worker
+    _blocks = {}
+    _blocks_lock = threading.Lock()
+
+    school_id = fields.Many2one('school.school', 'École', ondelete='cascade',
+                                help="Vide pour les étudiants sans école")
+    code = fields.Char('Code', required=True)
+    implementation = fields.Selection([('fast', 'Rapide'),
+                                       ('gapless', 'Sans trou')],
+                                      'Mode', required=True, default='fast')
+    number_next = fields.Integer('Prochain numéro', required=True, default=1)
+    block_size = fields.Integer('Taille du bloc', required=True, default=20,
+                                help="Numéros réservés à la fois par chaque \
+processus en mode rapide.")
+    padding = fields.Integer('Remplissage', required=True, default=3)
+
+    def init(self):
+        '''One counter per school and code, the global one included'''
+        self._cr.execute("""CREATE UNIQUE INDEX IF NOT EXISTS
+                              school_sequence_school_code_uniq
+                            ON school_sequence (COALESCE(school_id, 0), code)
+                         """)
+
+    @api.constrains('block_size')
+    def check_block_size(self):
+        if any(rec.block_size <= 0 for rec in self):
+            raise ValidationError(_('La taille du bloc doit être \
+supérieure à 0!'))
+
+    @api.model
+    def _get_sequence(self, code, school_id):
+        '''Return the counter of a school, creating it on first use. A new
+           counter starts where the global ir.sequence stands, so it never
+           hands out numbers already used before counters were per school.'''
+        domain = [('code', '=', code), ('school_id', '=', school_id or False)]
+        sequence = self.sudo().search(domain, limit=1)
+        if sequence:
+            return sequence
+        ir_seq = self.env['ir.sequence'].sudo().search([('code', '=', code)],
+                                                       limit=1)
+        self._cr.execute("""INSERT INTO school_sequence
+                              (school_id, code, implementation, number_next,
+                               block_size, padding, create_uid, create_date,
+                               write_uid, write_date)
+                            VALUES (%s, %s, 'fast', %s, 20, %s, %s,
+                                    now() at time zone 'UTC', %s,
+                                    now() at time zone 'UTC')
+                            ON CONFLICT ((COALESCE(school_id, 0)), code)
+                            DO UPDATE SET code = EXCLUDED.code
+                            RETURNING id""",
+                         (school_id or None, code,
+                          ir_seq.number_next_actual or 1,
+                          ir_seq.padding or 3, self._uid, self._uid))
+        # The insert waits for a transaction creating the same counter. If
+        # it commits, its row is not visible to this snapshot and updating
+        # it raises a serialization failure, so the request is retried and
+        # finds the counter instead of failing on a missing row.
+        return self.sudo().browse(self._cr.fetchone()[0])
+
+    def _reserve(self, count, cr, skip_locked=False):
+        '''Increment the counter by count on cursor cr, return the first
+           reserved number or None when the counter is not visible from cr,
+           or locked by another transaction with skip_locked'''
+        self.ensure_one()
+        cr.execute("""UPDATE school_sequence
+                      SET number_next = number_next + %s
+                      WHERE id IN (SELECT id FROM school_sequence
+                                   WHERE id = %s FOR UPDATE {})
+                      RETURNING number_next""".format(
+                          'SKIP LOCKED' if skip_locked else ''),
+                   (count, self.id))
+        row = cr.fetchone()
+        return row and row[0] - count
+
+    def _next_numbers_fast(self, count):
+        '''Serve numbers from the worker block, refilling it in a separate
+           committed transaction so no lock outlives the reservation. A
+           block reserved before the counter was last edited is dropped, so
+           a new `number_next` applies to every worker.'''
+        key = (self._cr.dbname, self.id)
+        stamp = self.write_date
+        numbers = []
+        with self._blocks_lock:
+            while len(numbers) < count:
+                block = self._blocks.get(key)
+                if not block or block[0] >= block[1] or block[2] != stamp:
+                    size = max(self.block_size, count - len(numbers))
+                    with self.pool.cursor() as cr:
+                        start = self._reserve(size, cr, skip_locked=True)
+                    if start is None:
+                        # Counter created or edited by the current
+                        # transaction, which may be rolled back, or locked
+                        # meanwhile: reserve in this transaction, uncached.
+                        start = self._reserve(count - len(numbers), self._cr)
+                        numbers.extend(range(start, start + count -
+                                             len(numbers)))
+                        break
+                    block = self._blocks[key] = [start, start + size, stamp]
+                take = min(count - len(numbers), block[1] - block[0])
+                numbers.extend(range(block[0], block[0] + take))
+                block[0] += take
+        self.invalidate_cache(['number_next'], self.ids)
+        return numbers
+
+    def write(self, vals):
+        res = super(SchoolSequence, self).write(vals)
+        with self._blocks_lock:
+            for rec in self:
+                self._blocks.pop((self._cr.dbname, rec.id), None)
+        return res
+
+    def _next_numbers(self, count=1):
+        '''Return count unique numbers of this counter'''
+        self.ensure_one()
+        if count <= 0:
+            return []
+        if self.implementation == 'gapless':
+            start = self._reserve(count, self._cr)
+            self.invalidate_cache(['number_next'], self.ids)
+            return list(range(start, start + count))
+        return self._next_numbers_fast(count)
+
+    @api.model
+    def next_codes(self, code, school_id=False, count=1):
+        '''Return count padded numbers of the counter `code` of a school'''
+        sequence = self._get_sequence(code, school_id)
+        return ['%0*d' % (sequence.padding, number)
+                for number in sequence._next_numbers(count)]
+
+    @api.model
+    def next_pids(self, school_id=False, count=1):
+        '''Return count personal identification numbers. The school code
+           is part of the PID so that per school counters stay unique.'''
+        prefix = datetime.now().strftime('%Y/%m/')
+        if school_id:
+            prefix += '%s/' % self.env['school.school'].browse(school_id).code
+        return [prefix + number for number in
+                self.next_codes('student.student', school_id, count)]
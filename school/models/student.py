@@ -3,12 +3,28 @@
 import time
 import base64
 from datetime import date
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
 from odoo.modules import get_module_resource
 from odoo.exceptions import except_orm
 from odoo.exceptions import ValidationError
 from .import school
 
+# Above this number of students, bulk operations run as background jobs
+JOB_MIN_RECORDS = 50
+
+# Counted tabs of the student form: count field -> one2many field
+RELATION_COUNTS = {
+    'history_count': 'history_ids',
+    'certificate_count': 'certificate_ids',
+    'discipline_count': 'student_discipline_line',
+    'document_count': 'document',
+    'description_count': 'description',
+    'award_count': 'award_list',
+    'reference_count': 'reference_ids',
+    'previous_school_count': 'previous_school_ids',
+    'family_contact_count': 'family_con_ids',
+}
+
 # from lxml import etree
 # added import statement in try-except because when server runs on
 # windows operating system issue arise because this library is not in Windows.
@@ -29,6 +45,14 @@ class StudentStudent(models.Model):
     def _search(self, args, offset=0, limit=None, order=None, count=False,
                 access_rights_uid=None):
         '''Method to get student of parent having group teacher'''
+        args = self._restrict_parent_args(args)
+        return super(StudentStudent, self)._search(
+            args=args, offset=offset, limit=limit, order=order, count=count,
+            access_rights_uid=access_rights_uid)
+
+    @api.model
+    def _restrict_parent_args(self, args):
+        '''Limit args to the children of the logged in parent'''
         teacher_group = self.env.user.has_group('school.group_school_teacher')
         parent_grp = self.env.user.has_group('school.group_school_parent')
         login_user = self.env['res.users'].browse(self._uid)
@@ -40,9 +64,62 @@ class StudentStudent(models.Model):
                                                    ])
             childrens = parent_login_stud.student_id
             args.append(('id', 'in', childrens.ids))
-        return super(StudentStudent, self)._search(
-            args=args, offset=offset, limit=limit, order=order, count=count,
-            access_rights_uid=access_rights_uid)
+        return args
+
+    def init(self):
+        '''Keyset index of the sync API and trigram index on the search
+           key when pg_trgm is available'''
+        tools.create_index(self._cr, 'student_student_write_date_id_idx',
+                           self._table, ['write_date', 'id'])
+        school.create_trigram_index(self._cr,
+                                    'student_student_search_key_trgm_idx',
+                                    self._table, 'search_key')
+
+    @api.model
+    def _has_trigram(self):
+        return school.has_trigram(self._cr)
+
+    @api.depends('user_id.name', 'middle', 'last', 'pid', 'student_code',
+                 'reg_code', 'parent_id.name')
+    def _compute_search_key(self):
+        '''Denormalised identity of the student used by name_search'''
+        for rec in self:
+            values = [rec.user_id.name, rec.middle, rec.last, rec.pid,
+                      rec.student_code, rec.reg_code]
+            values += rec.parent_id.mapped('name')
+            rec.search_key = ' '.join(value for value in values
+                                      if value).lower()
+
+    @api.model
+    def _name_search(self, name, args=None, operator='ilike', limit=100,
+                     name_get_uid=None):
+        '''Match name, identifiers and parents through the search key,
+           best trigram similarity first'''
+        if not name or operator != 'ilike':
+            return super(StudentStudent, self)._name_search(
+                name, args=args, operator=operator, limit=limit,
+                name_get_uid=name_get_uid)
+        model = self.with_user(name_get_uid) if name_get_uid else self
+        model.check_access_rights('read')
+        term = name.lower()
+        domain = model._restrict_parent_args(list(args or []))
+        query = model._where_calc(domain + [('search_key', 'ilike', term)])
+        model._apply_ir_rules(query, 'read')
+        from_clause, where_clause, params = query.get_sql()
+        if self._has_trigram():
+            order = 'similarity("student_student"."search_key", %s) DESC'
+        else:
+            order = 'strpos("student_student"."search_key", %s)'
+        query_str = """SELECT "student_student".id FROM %s WHERE %s
+                       ORDER BY %s, "student_student".id
+                    """ % (from_clause, where_clause or 'TRUE', order)
+        params = params + [term]
+        if limit:
+            query_str += ' LIMIT %s'
+            params.append(limit)
+        self._cr.execute(query_str, params)
+        ids = [row[0] for row in self._cr.fetchall()]
+        return models.lazy_name_get(self.browse(ids).with_user(name_get_uid))
 
     @api.depends('date_of_birth')
     def _compute_student_age(self):
@@ -62,50 +139,68 @@ class StudentStudent(models.Model):
     def check_age(self):
         '''Method to check age should be greater than 5'''
         current_dt = date.today()
-        if self.date_of_birth:
-            start = self.date_of_birth
-            age_calc = ((current_dt - start).days / 365)
+        errors = []
+        for rec in self.filtered('date_of_birth'):
+            age_calc = ((current_dt - rec.date_of_birth).days / 365)
             # Check if age less than required age
-            if age_calc < self.school_id.required_age:
-                raise ValidationError(_('''L'âge de l'élève doit être plus élevé \
-que% s ans!''' % (self.school_id.required_age)))
+            if age_calc < rec.school_id.required_age:
+                errors.append(_('''L'âge de l'élève doit être plus élevé \
+que% s ans!''') % rec.school_id.required_age + ' (%s)' % rec.name)
+        if errors:
+            raise ValidationError('\n'.join(errors))
 
-    @api.model
-    def create(self, vals):
+    @api.model_create_multi
+    def create(self, vals_list):
         '''Method to create user when student is created'''
-        if vals.get('pid', _('New')) == _('New'):
-            vals['pid'] = self.env['ir.sequence'
-                                   ].next_by_code('student.student'
-                                                  ) or _('New')
-        if vals.get('pid', False):
-            vals['login'] = vals['pid']
-            vals['password'] = vals['pid']
-        else:
-            raise except_orm(_('Error!'),
-                             _('''PID non valide
-                                  donc l'enregistrement ne sera pas sauvegardé.'''))
-        if vals.get('company_id', False):
-            company_vals = {'company_ids': [(4, vals.get('company_id'))]}
-            vals.update(company_vals)
-        if vals.get('email'):
-            school.emailvalidation(vals.get('email'))
-        res = super(StudentStudent, self).create(vals)
+        # Allocate the PIDs of each school in one call
+        new_pids = {}
+        for vals in vals_list:
+            if vals.get('pid', _('New')) == _('New'):
+                new_pids.setdefault(vals.get('school_id') or False,
+                                    []).append(vals)
+        sequence_obj = self.env['school.sequence']
+        for school_id, school_vals in new_pids.items():
+            pids = sequence_obj.next_pids(school_id, len(school_vals))
+            for vals, pid in zip(school_vals, pids):
+                vals['pid'] = pid
+        for vals in vals_list:
+            if vals.get('pid', False):
+                # An existing user (restored archive) keeps its credentials
+                if not vals.get('user_id'):
+                    vals['login'] = vals['pid']
+                    vals['password'] = vals['pid']
+            else:
+                raise except_orm(_('Error!'),
+                                 _('''PID non valide
+                                      donc l'enregistrement ne sera pas sauvegardé.'''))
+            if vals.get('company_id', False):
+                company_vals = {'company_ids': [(4, vals.get('company_id'))]}
+                vals.update(company_vals)
+            if vals.get('email'):
+                school.emailvalidation(vals.get('email'))
+        res = super(StudentStudent, self).create(vals_list)
         teacher = self.env['school.teacher']
-        for data in res.parent_id:
-            teacher_rec = teacher.search([('stu_parent_id',
-                                           '=', data.id)])
-            for record in teacher_rec:
-                record.write({'student_id': [(4, res.id, None)]})
+        for record in teacher.search([('stu_parent_id', 'in',
+                                       res.mapped('parent_id').ids)]):
+            children = res.filtered(
+                lambda stud: record.stu_parent_id in stud.parent_id)
+            record.write({'student_id': [(4, stud.id) for stud in children]})
         # Assign group to student based on condition
         emp_grp = self.env.ref('base.group_user')
-        if res.state == 'draft':
+        draft = res.filtered(lambda stud: stud.state == 'draft')
+        if draft:
             admission_group = self.env.ref('school.group_is_admission')
             new_grp_list = [admission_group.id, emp_grp.id]
-            res.user_id.write({'groups_id': [(6, 0, new_grp_list)]})
-        elif res.state == 'done':
+            draft.mapped('user_id').write({'groups_id': [(6, 0,
+                                                          new_grp_list)]})
+        done = res.filtered(lambda stud: stud.state == 'done')
+        if done:
             done_student = self.env.ref('school.group_school_student')
             group_list = [done_student.id, emp_grp.id]
-            res.user_id.write({'groups_id': [(6, 0, group_list)]})
+            done.mapped('user_id').write({'groups_id': [(6, 0, group_list)]})
+        # New students may join class rosters
+        res.mapped('standard_id')._bump_roster()
+        self.env['student.event'].log_changes(res)
         return res
 
     def write(self, vals):
@@ -116,7 +211,31 @@ que% s ans!''' % (self.school_id.required_age)))
                                                '=', parent)])
                 for data in teacher_rec:
                     data.write({'student_id': [(4, self.id)]})
-        return super(StudentStudent, self).write(vals)
+        lifecycle = {'state', 'standard_id'} & set(vals)
+        if lifecycle:
+            before = {rec.id: (rec.state, rec.standard_id.id) for rec in self}
+        roster_fields = [name for name in school.ROSTER_TRIGGERS
+                         if name in vals]
+        if roster_fields:
+            roster_before = {rec.id: (rec.standard_id,
+                                      [rec[name] for name in roster_fields])
+                             for rec in self}
+        res = super(StudentStudent, self).write(vals)
+        if roster_fields:
+            # Only the classes whose roster really changed are renewed
+            standards = self.env['school.standard']
+            for rec in self:
+                standard, values = roster_before[rec.id]
+                if values != [rec[name] for name in roster_fields]:
+                    standards |= standard | rec.standard_id
+            standards._bump_roster()
+        if lifecycle:
+            self.env['student.event'].log_changes(self, before)
+        return res
+
+    def unlink(self):
+        self.mapped('standard_id')._bump_roster()
+        return super(StudentStudent, self).unlink()
 
     @api.model
     def _default_image(self):
@@ -134,6 +253,47 @@ que% s ans!''' % (self.school_id.required_age)))
                 if teacher:
                     rec.teachr_user_grp = True
 
+    def _compute_relation_counts(self):
+        '''Count the lines of the student tabs with one grouped query per
+           relation for the whole recordset, not one query per student'''
+        student_ids = [rec_id for rec_id in self.ids
+                       if isinstance(rec_id, int)]
+        counts = {}
+        for count_name, field_name in RELATION_COUNTS.items():
+            field = self._fields[field_name]
+            comodel = self.env[field.comodel_name]
+            inverse = field.inverse_name
+            counts[count_name] = {}
+            if not student_ids or not comodel.check_access_rights(
+                    'read', raise_exception=False):
+                continue
+            for group in comodel.read_group([(inverse, 'in', student_ids)],
+                                            [inverse], [inverse]):
+                counts[count_name][group[inverse][0]] = \
+                    group[inverse + '_count']
+        for rec in self:
+            for count_name in RELATION_COUNTS:
+                rec[count_name] = counts[count_name].get(rec.id, 0)
+
+    def action_view_relation(self):
+        '''Open the lines of the student tab named by the `relation` key of
+           the context, loaded only when asked for'''
+        self.ensure_one()
+        field_name = self._context.get('relation')
+        if field_name not in RELATION_COUNTS.values():
+            raise ValidationError(_('Onglet inconnu: %s') % field_name)
+        field = self._fields[field_name]
+        context = {'default_' + field.inverse_name: self.id}
+        if self.state in ('alumni', 'terminate') or \
+                field_name == 'history_ids':
+            context['create'] = False
+        return {'type': 'ir.actions.act_window',
+                'name': '%s - %s' % (field.string, self.name),
+                'res_model': field.comodel_name,
+                'view_mode': 'tree,form',
+                'domain': [(field.inverse_name, '=', self.id)],
+                'context': context}
+
     @api.model
     def check_current_year(self):
         '''Method to get default value of logged in Student'''
@@ -150,7 +310,7 @@ défini! Veuillez contacter l'administrateur!'''
                                      'Détails du contact familial',
                                      states={'done': [('readonly', True)]})
     user_id = fields.Many2one('res.users', "Identifiant d'utilisateur", ondelete="cascade",
-                              required=True, delegate=True)
+                              required=True, delegate=True, index=True)
     student_name = fields.Char("Nom d'étudiant", related='user_id.name',
                                store=True, readonly=True)
     pid = fields.Char("Carte d'étudiant", required=True,
@@ -159,10 +319,19 @@ défini! Veuillez contacter l'administrateur!'''
     reg_code = fields.Char("Code d'enregistrement",
                            help="Code d'inscription étudiant")
     student_code = fields.Char('Code étudiant')
+    search_key = fields.Char('Clé de recherche', compute='_compute_search_key',
+                             store=True, readonly=True)
     contact_phone = fields.Char('No de téléphone')
     contact_mobile = fields.Char('No de mobile')
     roll_no = fields.Integer('Roll No.', readonly=True)
-    photo = fields.Binary('Photo', default=_default_image)
+    photo = fields.Image('Photo', default=_default_image, max_width=1920,
+                         max_height=1920)
+    # Resized variants computed once on write, used by lists, kanban
+    # cards and identity cards instead of the full photo
+    photo_512 = fields.Image('Photo 512', related='photo', max_width=512,
+                             max_height=512, store=True)
+    photo_128 = fields.Image('Photo 128', related='photo', max_width=128,
+                             max_height=128, store=True)
     year = fields.Many2one('academic.year', 'Année scolaire', readonly=True,
                            default=check_current_year)
     cast_id = fields.Many2one('student.cast', 'Religion')
@@ -216,6 +385,15 @@ défini! Veuillez contacter l'administrateur!'''
                               ('cancel', 'Cancel'),
                               ('alumni', 'Alumni')],
                              'Statut', readonly=True, default="draft")
+    percentage = fields.Float('Pourcentage', readonly=True,
+                              help="Pourcentage de l'année en cours")
+    result = fields.Char('Résultat', readonly=True,
+                         help="Résultat de l'année en cours")
+    grade = fields.Char('Note', readonly=True,
+                        help="Note de l'année en cours")
+    rank = fields.Integer('Rang', readonly=True,
+                          help="Rang dans la classe pour l'année en cours")
+    mark_ids = fields.One2many('student.mark', 'student_id', 'Notes')
     history_ids = fields.One2many('student.history', 'student_id', 'Histoire')
     certificate_ids = fields.One2many('student.certificate', 'student_id',
                                       'Certificat')
@@ -226,6 +404,24 @@ défini! Veuillez contacter l'administrateur!'''
                                   'Description')
     award_list = fields.One2many('student.award', 'award_list_id',
                                  'Liste des récompenses')
+    history_count = fields.Integer('Historique',
+                                   compute='_compute_relation_counts')
+    certificate_count = fields.Integer('Certificats',
+                                       compute='_compute_relation_counts')
+    discipline_count = fields.Integer('Discipline',
+                                      compute='_compute_relation_counts')
+    document_count = fields.Integer('Documents',
+                                    compute='_compute_relation_counts')
+    description_count = fields.Integer('Remarques',
+                                       compute='_compute_relation_counts')
+    award_count = fields.Integer('Récompenses',
+                                 compute='_compute_relation_counts')
+    reference_count = fields.Integer('Références',
+                                     compute='_compute_relation_counts')
+    previous_school_count = fields.Integer('Écoles précédentes',
+                                           compute='_compute_relation_counts')
+    family_contact_count = fields.Integer('Contacts familiaux',
+                                          compute='_compute_relation_counts')
     stu_name = fields.Char('Prénom', related='user_id.name',
                            readonly=True)
     Acadamic_year = fields.Char('Année', related='year.name',
@@ -238,6 +434,9 @@ défini! Veuillez contacter l'administrateur!'''
                                  'students_parent_id', 'Parent(s)',
                                  states={'done': [('readonly', True)]})
     terminate_reason = fields.Text('Raison')
+    leave_date = fields.Date('Date de départ', readonly=True, copy=False,
+                             help="Date du passage en ancien élève ou de \
+la résiliation")
     active = fields.Boolean(default=True)
     teachr_user_grp = fields.Boolean("Groupe d'enseignants",
                                      compute="_compute_teacher_user",
@@ -250,9 +449,14 @@ défini! Veuillez contacter l'administrateur!'''
 
     def set_alumni(self):
         '''Method to change state to alumni'''
+        if len(self) > JOB_MIN_RECORDS and not self._context.get('school_job'):
+            jobs = self.env['school.job'].enqueue(
+                self, 'set_alumni', _('Passage en anciens élèves'))
+            return jobs.action_view_jobs()
         student_user = self.env['res.users']
         for rec in self:
             rec.state = 'alumni'
+            rec.leave_date = fields.Date.today()
             rec.standard_id._compute_total_student()
             user = student_user.search([('id', '=',
                                          rec.user_id.id)])
@@ -260,6 +464,62 @@ défini! Veuillez contacter l'administrateur!'''
             if user:
                 user.active = False
 
+    def _move_next_standard(self):
+        '''Move the students to the next standard of their school'''
+        academic_obj = self.env['academic.year']
+        school_stand_obj = self.env['school.standard']
+        standard_obj = self.env["standard.standard"]
+        for stud in self:
+            year_id = academic_obj.next_year(stud.year.sequence)
+            academic_year = academic_obj.search([('id', '=', year_id)],
+                                                limit=1)
+            standard_seq = stud.standard_id.standard_id.sequence
+            next_class_id = standard_obj.next_standard(standard_seq)
+
+            # Assign the academic year
+            if next_class_id:
+                division = (stud.standard_id.division_id.id or False)
+                next_stand = school_stand_obj.\
+                    search([('standard_id', '=', next_class_id),
+                            ('division_id', '=', division),
+                            ('school_id', '=', stud.school_id.id),
+                            ('medium_id', '=', stud.medium_id.id)])
+                if next_stand:
+                    std_vals = {'year': academic_year.id,
+                                'standard_id': next_stand.id}
+                    # Move student to next standard
+                    stud.write(std_vals)
+        return True
+
+    def _assign_roll_no(self):
+        '''Number the students in order, after the students of the
+           previous chunks of the job'''
+        number = self._context.get('school_job_offset', 0)
+        for student in self:
+            number += 1
+            student.write({'roll_no': number})
+        return True
+
+    def action_print_identity_cards(self):
+        '''Print the identity cards of the students from a job'''
+        jobs = self.env['school.job'].enqueue(
+            self, '_print_identity_cards', _("Impression des cartes \
+d'identité"), chunk_size=200)
+        return jobs.action_view_jobs()
+
+    def _print_identity_cards(self):
+        '''Attach the identity cards of the students to their job'''
+        report = self.env.ref('school.report_student_student')
+        pdf = report.render_qweb_pdf(self.ids)[0]
+        offset = self._context.get('school_job_offset', 0)
+        self.env['ir.attachment'].sudo().create({
+            'name': _("cartes-%s-%s.pdf") % (offset + 1, offset + len(self)),
+            'res_model': 'school.job',
+            'res_id': self._context.get('school_job_id'),
+            'mimetype': 'application/pdf',
+            'datas': base64.b64encode(pdf)})
+        return True
+
     def set_done(self):
         '''Method to change state to done'''
         self.state = 'done'
@@ -270,7 +530,8 @@ défini! Veuillez contacter l'administrateur!'''
 
     def set_terminate(self):
         '''Set the state to terminate'''
-        self.state = 'terminate'
+        self.write({'state': 'terminate',
+                    'leave_date': fields.Date.today()})
 
     def cancel_admission(self):
         '''Set the state to cancel.'''
@@ -279,7 +540,7 @@ défini! Veuillez contacter l'administrateur!'''
     def admission_done(self):
         '''Method to confirm admission'''
         school_standard_obj = self.env['school.standard']
-        ir_sequence = self.env['ir.sequence']
+        sequence_obj = self.env['school.sequence']
         student_group = self.env.ref('school.group_school_student')
         emp_group = self.env.ref('base.group_user')
         for rec in self:
@@ -288,32 +549,39 @@ défini! Veuillez contacter l'administrateur!'''
             if rec.standard_id.remaining_seats <= 0:
                 raise ValidationError(_('Seats of class %s are full'
                                         ) % rec.standard_id.standard_id.name)
-            domain = [('school_id', '=', rec.school_id.id)]
-            # Checks the standard if not defined raise error
-            if not school_standard_obj.search(domain):
-                raise except_orm(_('Warning'),
-                                 _('''La norme n'est pas définie dans
-                                      école'''))
-            # Assign group to student
-            rec.user_id.write({'groups_id': [(6, 0, [emp_group.id,
-                                                     student_group.id])]})
-            # Assign roll no to student
+        schools = self.mapped('school_id')
+        # Checks the standard if not defined raise error
+        standard_schools = school_standard_obj.search(
+            [('school_id', 'in', schools.ids)]).mapped('school_id')
+        if (schools - standard_schools or
+                self.filtered(lambda rec: not rec.school_id)):
+            raise except_orm(_('Warning'),
+                             _('''La norme n'est pas définie dans
+                                  école'''))
+        # Assign group to student
+        self.mapped('user_id').write({'groups_id': [(6, 0, [emp_group.id,
+                                                            student_group.id])]})
+        admission_date = time.strftime('%Y-%m-%d')
+        for school_rec in schools:
+            students = self.filtered(lambda rec: rec.school_id == school_rec)
+            # Assign registration and student codes, one allocation per school
+            reg_codes = sequence_obj.next_codes('student.registration',
+                                                school_rec.id, len(students))
+            stu_codes = sequence_obj.next_codes('student.code',
+                                                school_rec.id, len(students))
+            reg_prefix = '%s/%s/%s/' % (school_rec.state_id.name,
+                                        school_rec.city, school_rec.name)
+            for rec, reg_code, stu_code in zip(students, reg_codes,
+                                               stu_codes):
+                rec.write({'state': 'done',
+                           'admission_date': admission_date,
+                           'student_code': '%s/%s/%s' % (school_rec.code,
+                                                         rec.year.code,
+                                                         stu_code),
+                           'reg_code': reg_prefix + reg_code})
+            # Assign roll no to the students of the school
             number = 1
-            for rec_std in rec.search(domain):
+            for rec_std in self.search([('school_id', '=', school_rec.id)]):
                 rec_std.roll_no = number
                 number += 1
-            # Assign registration code to student
-            reg_code = ir_sequence.next_by_code('student.registration')
-            registation_code = (str(rec.school_id.state_id.name) + str('/') +
-                                str(rec.school_id.city) + str('/') +
-                                str(rec.school_id.name) + str('/') +
-                                str(reg_code))
-            stu_code = ir_sequence.next_by_code('student.code')
-            student_code = (str(rec.school_id.code) + str('/') +
-                            str(rec.year.code) + str('/') +
-                            str(stu_code))
-            rec.write({'state': 'done',
-                       'admission_date': time.strftime('%Y-%m-%d'),
-                       'student_code': student_code,
-                       'reg_code': registation_code})
         return True
@@ -0,0 +1,218 @@
+# See LICENSE file for full copyright and licensing details.
+
+import json
+import threading
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from odoo.models import MAGIC_COLUMNS
+
+
+class StudentArchive(models.Model):
+    '''Cold storage of alumni and terminated students.
+
+       Archived students are removed from student_student together with
+       their one2many details and reminders, and kept here as a JSON
+       snapshot next to the few fields needed to find them. The snapshot
+       also keeps the reminders and the records of other models linking to
+       the student, such as teachers. Restoring recreates the student on
+       its original user with its reminders and links.'''
+
+    _name = 'student.archive'
+    _description = 'Archive des étudiants'
+    _order = 'archive_date desc, id desc'
+
+    name = fields.Char("Nom d'étudiant", readonly=True, index=True)
+    pid = fields.Char("Carte d'étudiant", readonly=True, index=True)
+    student_code = fields.Char('Code étudiant', readonly=True)
+    reg_code = fields.Char("Code d'enregistrement", readonly=True)
+    user_id = fields.Many2one('res.users', "Identifiant d'utilisateur",
+                              readonly=True, ondelete='set null')
+    school_id = fields.Many2one('school.school', 'École', readonly=True,
+                                index=True)
+    standard_id = fields.Many2one('school.standard', 'Class', readonly=True)
+    year = fields.Many2one('academic.year', 'Année scolaire', readonly=True)
+    state = fields.Selection([('terminate', 'Terminate'),
+                              ('alumni', 'Alumni')], 'Statut', readonly=True)
+    leave_date = fields.Date('Date de départ', readonly=True)
+    archive_date = fields.Date("Date d'archivage", readonly=True,
+                               default=fields.Date.today)
+    data = fields.Text('Données', readonly=True)
+
+    @api.model
+    def _serialize(self, records):
+        '''Return the stored values of records and, recursively, of their
+           one2many lines, as JSON compatible dicts.'''
+        if not records:
+            return []
+        names, lines = [], []
+        for name, field in records._fields.items():
+            if (not field.store or field.compute or field.related or
+                    field.inherited or name in MAGIC_COLUMNS):
+                continue
+            if field.type == 'one2many':
+                lines.append(name)
+            else:
+                names.append(name)
+        result = []
+        for rec, values in zip(records, records.read(names)):
+            for name in names:
+                field = records._fields[name]
+                if field.type == 'many2one':
+                    values[name] = values[name] and values[name][0]
+                elif field.type in ('date', 'datetime'):
+                    values[name] = field.to_string(values[name])
+                elif field.type == 'binary' and isinstance(values[name],
+                                                           bytes):
+                    values[name] = values[name].decode()
+            for name in lines:
+                values[name] = self._serialize(rec[name])
+            result.append(values)
+        return result
+
+    @api.model
+    def _deserialize(self, model, values):
+        '''Turn a snapshot back into create() values of model, dropping the
+           links to records deleted in the meantime.'''
+        vals = {}
+        for name, value in values.items():
+            field = model._fields.get(name)
+            if not field or name == 'id':
+                continue
+            if field.type == 'many2one' and value:
+                value = model.env[field.comodel_name].browse(value).exists().id
+            elif field.type == 'many2many':
+                value = [(6, 0, model.env[field.comodel_name].browse(
+                    value).exists().ids)]
+            elif field.type == 'one2many':
+                comodel = model.env[field.comodel_name]
+                value = [(0, 0, self._deserialize(comodel, line))
+                         for line in value]
+            vals[name] = value
+        return vals
+
+    @api.model
+    def _get_student_links(self):
+        '''Stored many2many fields of other models targeting students'''
+        return [(model_name, name) for model_name, model in
+                sorted(self.env.registry.items())
+                if model_name != 'student.student' and not model._abstract
+                and not model._transient
+                for name, field in sorted(model._fields.items())
+                if field.type == 'many2many' and field.store and
+                field.comodel_name == 'student.student' and
+                not field.compute and not field.related]
+
+    @api.model
+    def _snapshot_relations(self, students, snapshots):
+        '''Add the reminders of the students and the records linking to
+           them to their snapshots'''
+        reminders = self.env['student.reminder'].with_context(
+            active_test=False).search([('stu_id', 'in', students.ids)])
+        for student, snapshot in zip(students, snapshots):
+            snapshot['__reminders'] = self._serialize(
+                reminders.filtered(lambda rem: rem.stu_id == student))
+            snapshot['__links'] = {}
+        for model_name, name in self._get_student_links():
+            records = self.env[model_name].with_context(
+                active_test=False).search([(name, 'in', students.ids)])
+            for student, snapshot in zip(students, snapshots):
+                linked = records.filtered(lambda rec: student in rec[name])
+                if linked:
+                    snapshot['__links']['%s,%s' % (model_name, name)] = \
+                        linked.ids
+        return reminders
+
+    @api.model
+    def _restore_relations(self, student, snapshot):
+        '''Recreate the reminders and links of a restored student'''
+        reminder_obj = self.env['student.reminder']
+        reminder_obj.create([dict(self._deserialize(reminder_obj, values),
+                                  stu_id=student.id)
+                             for values in snapshot.get('__reminders', [])])
+        for key, ids in snapshot.get('__links', {}).items():
+            model_name, name = key.split(',')
+            if model_name not in self.env or \
+                    name not in self.env[model_name]._fields:
+                continue
+            self.env[model_name].with_context(active_test=False).browse(
+                ids).exists().write({name: [(4, student.id)]})
+
+    @api.model
+    def archive_students(self, students):
+        '''Move students to the archive and delete them and their details'''
+        students = students.with_context(active_test=False)
+        snapshots = self._serialize(students)
+        reminders = self._snapshot_relations(students, snapshots)
+        self.create([{'name': student.name,
+                      'pid': student.pid,
+                      'student_code': student.student_code,
+                      'reg_code': student.reg_code,
+                      'user_id': student.user_id.id,
+                      'school_id': student.school_id.id,
+                      'standard_id': student.standard_id.id,
+                      'year': student.year.id,
+                      'state': student.state,
+                      'leave_date': student.leave_date,
+                      'data': json.dumps(snapshot)}
+                     for student, snapshot in zip(students, snapshots)])
+        # Reminders hold a required link to the student
+        reminders.unlink()
+        self._unlink_with_lines(students)
+        return True
+
+    @api.model
+    def _unlink_with_lines(self, records):
+        '''Delete records after their one2many lines, recursively'''
+        for name, field in records._fields.items():
+            if field.type == 'one2many' and field.store:
+                self._unlink_with_lines(records.mapped(name))
+        records.unlink()
+
+    @api.model
+    def _get_students_to_archive(self, limit=None):
+        '''Alumni and terminated students older than their school horizon'''
+        self.env['student.student'].flush(['state', 'leave_date',
+                                           'school_id'])
+        today = fields.Date.today()
+        self._cr.execute("""SELECT s.id FROM student_student s
+                            JOIN school_school sc ON sc.id = s.school_id
+                            WHERE s.state IN ('alumni', 'terminate')
+                              AND sc.archive_after_days > 0
+                              AND COALESCE(s.leave_date, s.write_date::date)
+                                  < %s - sc.archive_after_days
+                            ORDER BY s.id LIMIT %s""", (today, limit))
+        return self.env['student.student'].with_context(
+            active_test=False).browse([row[0] for row in
+                                       self._cr.fetchall()])
+
+    @api.model
+    def _cron_archive_students(self, batch_size=200):
+        '''Archive old alumni and terminated students by committed chunks'''
+        auto_commit = not getattr(threading.currentThread(), 'testing', False)
+        while True:
+            students = self._get_students_to_archive(limit=batch_size)
+            if not students:
+                break
+            self.archive_students(students)
+            if not auto_commit:
+                break
+            self.env.cr.commit()
+        self.env['school.enrolment.report'].refresh()
+        return True
+
+    def action_restore(self):
+        '''Recreate the archived students and drop their archive'''
+        student_obj = self.env['student.student'].with_context(
+            active_test=False)
+        for rec in self:
+            if not rec.user_id:
+                raise UserError(_("L'utilisateur de l'étudiant %s a été \
+supprimé, il ne peut pas être restauré.") % rec.name)
+            snapshot = json.loads(rec.data)
+            values = self._deserialize(student_obj, snapshot)
+            values['user_id'] = rec.user_id.id
+            self._restore_relations(student_obj.create(values), snapshot)
+        self.unlink()
+        return True
+
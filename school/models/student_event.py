@@ -0,0 +1,142 @@
+# See LICENSE file for full copyright and licensing details.
+
+from datetime import timedelta
+
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError
+
+STATES = [('draft', 'Draft'),
+          ('done', 'Done'),
+          ('terminate', 'Terminate'),
+          ('cancel', 'Cancel'),
+          ('alumni', 'Alumni')]
+
+
+class StudentEvent(models.Model):
+    '''Append-only log of the student lifecycle: creations, state changes
+       and class changes, written in the transaction making the change.
+
+       Every row also stores the id of its PostgreSQL transaction, set by a
+       column default. Events are read in (transaction, id) order and only
+       once every transaction which could still add older events has
+       ended, so the (transaction, id) cursor of a consumer only moves
+       forward and no event committed late is ever skipped.'''
+
+    _name = 'student.event'
+    _description = "Événement d'étudiant"
+    _order = 'id desc'
+    _rec_name = 'pid'
+
+    RETENTION_PARAM = 'school.student_event_retention_days'
+    DEFAULT_RETENTION = 180
+
+    student_id = fields.Many2one('student.student', 'Étudiant', readonly=True,
+                                 index=True, ondelete='set null')
+    pid = fields.Char("Carte d'étudiant", readonly=True)
+    school_id = fields.Many2one('school.school', 'École', readonly=True,
+                                ondelete='set null')
+    event_type = fields.Selection([('create', 'Création'),
+                                   ('state', 'Changement de statut'),
+                                   ('standard', 'Changement de classe')],
+                                  'Événement', readonly=True, required=True)
+    old_state = fields.Selection(STATES, 'Ancien statut', readonly=True)
+    new_state = fields.Selection(STATES, 'Nouveau statut', readonly=True)
+    old_standard_id = fields.Many2one('school.standard', 'Ancienne classe',
+                                      readonly=True, ondelete='set null')
+    new_standard_id = fields.Many2one('school.standard', 'Nouvelle classe',
+                                      readonly=True, ondelete='set null')
+
+    def init(self):
+        '''Transaction id column filled by PostgreSQL, the index of the
+           consumers and the one of the retention cleanup'''
+        self._cr.execute("""ALTER TABLE student_event ADD COLUMN IF NOT EXISTS
+                              txid BIGINT NOT NULL DEFAULT txid_current()""")
+        tools.create_index(self._cr, 'student_event_txid_idx', self._table,
+                           ['txid', 'id'])
+        tools.create_index(self._cr, 'student_event_create_date_idx',
+                           self._table, ['create_date'])
+
+    @api.model
+    def log_changes(self, students, before=None):
+        '''Log the lifecycle changes of students; before maps the id of a
+           student to its (state, class id) previous values, None for new
+           students.'''
+        vals_list = []
+        for student in students:
+            new = (student.state, student.standard_id.id)
+            old = before[student.id] if before else (False, False)
+            if old == new:
+                continue
+            if not before:
+                event_type = 'create'
+            elif old[0] != new[0]:
+                event_type = 'state'
+            else:
+                event_type = 'standard'
+            vals_list.append({'student_id': student.id,
+                              'pid': student.pid,
+                              'school_id': student.school_id.id,
+                              'event_type': event_type,
+                              'old_state': old[0],
+                              'new_state': new[0],
+                              'old_standard_id': old[1],
+                              'new_standard_id': new[1]})
+        return self.sudo().create(vals_list)
+
+    def write(self, vals):
+        '''The log is append-only'''
+        raise UserError(_("Les événements d'étudiants ne peuvent pas être \
+modifiés."))
+
+    @api.model
+    def read_events(self, cursor=None, limit=500):
+        '''Return the events following cursor, oldest first.
+
+           Pass the returned `next_cursor` to get the following batch; it is
+           the cursor given when there are no new events yet.'''
+        self.check_access_rights('read')
+        self.flush()
+        txid, event_id = cursor or (0, 0)
+        self._cr.execute("""SELECT id, txid FROM student_event
+                            WHERE txid < txid_snapshot_xmin(
+                                      txid_current_snapshot())
+                              AND (txid, id) > (%s, %s)
+                            ORDER BY txid, id LIMIT %s""",
+                         (int(txid), int(event_id), int(limit)))
+        rows = self._cr.fetchall()
+        events = self.browse([row[0] for row in rows])
+        events.check_access_rule('read')
+        items = []
+        for event in events:
+            items.append({'id': event.id,
+                          'student_id': event.student_id.id,
+                          'pid': event.pid,
+                          'school_id': event.school_id.id,
+                          'event_type': event.event_type,
+                          'old_state': event.old_state,
+                          'new_state': event.new_state,
+                          'old_standard_id': event.old_standard_id.id,
+                          'new_standard_id': event.new_standard_id.id,
+                          'date': fields.Datetime.to_string(
+                              event.create_date)})
+        return {'events': items,
+                'next_cursor': (list(rows[-1][::-1]) if rows
+                                else [int(txid), int(event_id)])}
+
+    @api.model
+    def _cron_purge_events(self, batch_size=10000):
+        '''Delete the events older than the retention period'''
+        days = int(self.env['ir.config_parameter'].sudo().get_param(
+            self.RETENTION_PARAM, self.DEFAULT_RETENTION))
+        if days <= 0:
+            return True
+        limit_date = fields.Datetime.now() - timedelta(days=days)
+        while True:
+            self._cr.execute("""DELETE FROM student_event WHERE id IN (
+                                  SELECT id FROM student_event
+                                  WHERE create_date < %s LIMIT %s)""",
+                             (limit_date, batch_size))
+            if self._cr.rowcount < batch_size:
+                break
+        self.invalidate_cache()
+        return True
@@ -1,6 +1,6 @@
 # See LICENSE file for full copyright and licensing details.
 
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
 
 
 class SchoolTeacher(models.Model):
@@ -35,6 +35,11 @@ class SchoolTeacher(models.Model):
                                   'Enfants')
     phone_numbers = fields.Char("Numéro de téléphone")
 
+    def init(self):
+        '''Index walked by the sync API in (write_date, id) order'''
+        tools.create_index(self._cr, 'school_teacher_write_date_id_idx',
+                           self._table, ['write_date', 'id'])
+
     @api.onchange('is_parent')
     def _onchange_isparent(self):
         if self.is_parent:
@@ -149,3 +154,11 @@ class SchoolTeacher(models.Model):
             self.work_phone = phone
             self.phone_numbers = phone
             phone = self.school_id.company_id.partner_id.phone
+
+    def action_repair_timetable(self):
+        '''Reschedule the periods of the teacher in the school timetables'''
+        lines = self.env['school.timetable.line'].search([('teacher_id', 'in',
+                                                           self.ids)])
+        schools = lines.mapped('school_id') | self.mapped('school_id')
+        schools.repair_timetable(self)
+        return True
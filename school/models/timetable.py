@@ -0,0 +1,195 @@
+# See LICENSE file for full copyright and licensing details.
+
+from collections import defaultdict
+
+from odoo import models, fields, _
+
+
+def solve_timetable(groups, days, periods, existing=(), unavailable=()):
+    '''Build a weekly timetable without double booked class, teacher or
+       room.
+
+       groups lists the lessons to schedule as (class, subject, candidate
+       teachers, room, weekly periods) tuples and existing the lessons
+       already placed as (class, subject, teacher, room, slot) tuples. A
+       slot is day * periods + period. Existing lessons keep their teacher
+       and only move when needed to make room for a new lesson, which
+       repairs a timetable incrementally. unavailable lists the (kind, id,
+       slot) booked elsewhere, kind being 'teacher' or 'room'.
+
+       Each group gets the candidate teacher with the lowest load, then its
+       periods are placed greedily, busiest teachers first, on the free slot
+       spreading the subject best over the week. The occupation of every
+       class, teacher and room is a bitmask of its slots, so free slots are
+       found with a few integer operations. When no slot is free, the
+       lessons blocking a slot are moved elsewhere to make room, moving
+       their own blockers in turn up to two levels deep.
+
+       Return the new lessons as (class, subject, teacher, room, slot)
+       tuples, the (class, subject, missing periods) left unplaced and the
+       new slots of the moved existing lessons, by index in existing.'''
+    size = days * periods
+    full = (1 << size) - 1
+    busy = defaultdict(int)
+    occupant = {}
+    load = defaultdict(int)
+    per_day = defaultdict(int)
+    lessons = []
+    journal = []
+
+    def keys(lesson):
+        return [key for key in (('class', lesson[0]), ('teacher', lesson[2]),
+                                ('room', lesson[3])) if key[1]]
+
+    def occupy(index, slot, log=True):
+        lesson = lessons[index]
+        lesson[4] = slot
+        for key in keys(lesson):
+            busy[key] |= 1 << slot
+            occupant[key + (slot,)] = index
+        per_day[lesson[0], lesson[1], slot // periods] += 1
+        per_day[lesson[0], slot // periods] += 1
+        if log:
+            journal.append((index, None))
+
+    def release(index, log=True):
+        lesson = lessons[index]
+        slot = lesson[4]
+        for key in keys(lesson):
+            busy[key] &= ~(1 << slot)
+            del occupant[key + (slot,)]
+        per_day[lesson[0], lesson[1], slot // periods] -= 1
+        per_day[lesson[0], slot // periods] -= 1
+        lesson[4] = None
+        if log:
+            journal.append((index, slot))
+
+    def rollback(mark):
+        while len(journal) > mark:
+            index, slot = journal.pop()
+            if slot is None:
+                release(index, log=False)
+            else:
+                occupy(index, slot, log=False)
+
+    def free_slots(lesson):
+        mask = full
+        for key in keys(lesson):
+            mask &= ~busy[key]
+        return mask
+
+    def best_slot(lesson, mask):
+        best = None
+        while mask:
+            low = mask & -mask
+            mask ^= low
+            slot = low.bit_length() - 1
+            day = slot // periods
+            score = (per_day[lesson[0], lesson[1], day],
+                     per_day[lesson[0], day], slot % periods, day)
+            if best is None or score < best[0]:
+                best = (score, slot)
+        return best and best[1]
+
+    def place(index, depth, locked):
+        lesson = lessons[index]
+        slot = best_slot(lesson, free_slots(lesson))
+        if slot is not None:
+            occupy(index, slot)
+            return True
+        if not depth:
+            return False
+        # Take the slot with the fewest blockers which can all be placed
+        # again elsewhere, recursively up to depth moves deep
+        candidates = []
+        for slot in range(size):
+            blockers = {occupant.get(key + (slot,)) for key in keys(lesson)}
+            blockers.discard(None)
+            if (len(blockers) <= 2 and -1 not in blockers and
+                    not blockers & locked):
+                candidates.append((len(blockers), slot, blockers))
+        candidates.sort(key=lambda candidate: candidate[:2])
+        locked = locked | {index}
+        for _count, slot, blockers in candidates:
+            mark = len(journal)
+            for blocker in blockers:
+                release(blocker)
+            occupy(index, slot)
+            if all(place(blocker, depth - 1, locked | blockers)
+                   for blocker in blockers):
+                return True
+            rollback(mark)
+        return False
+
+    for kind, res_id, slot in unavailable:
+        busy[kind, res_id] |= 1 << slot
+        occupant[kind, res_id, slot] = -1
+    for class_id, subject_id, teacher_id, room_id, slot in existing:
+        lessons.append([class_id, subject_id, teacher_id, room_id, None, True])
+        occupy(len(lessons) - 1, slot)
+        load[teacher_id] += 1
+    todo = []
+    for class_id, subject_id, candidates, room_id, count in sorted(
+            groups, key=lambda group: (len(group[2]), -group[4])):
+        teacher_id = min(candidates, key=lambda teacher: (load[teacher],
+                                                           teacher),
+                         default=False)
+        load[teacher_id] += count
+        for _i in range(count):
+            lessons.append([class_id, subject_id, teacher_id, room_id, None,
+                            False])
+            todo.append(len(lessons) - 1)
+    todo.sort(key=lambda index: (-load[lessons[index][2] or None],
+                                 lessons[index][2] or 0, lessons[index][0],
+                                 lessons[index][1]))
+    missing = defaultdict(int)
+    for index in todo:
+        if not place(index, 2, set()):
+            missing[lessons[index][0], lessons[index][1]] += 1
+        del journal[:]
+    placed = [tuple(lesson[:5]) for lesson in lessons
+              if not lesson[5] and lesson[4] is not None]
+    unplaced = [key + (count,) for key, count in missing.items()]
+    moved = {index: lessons[index][4]
+             for index, lesson in enumerate(existing)
+             if lessons[index][4] != lesson[4]}
+    return placed, unplaced, moved
+
+
+class SchoolTimetableLine(models.Model):
+    '''Weekly period of a class generated by the timetable scheduler'''
+
+    _name = 'school.timetable.line'
+    _description = "Ligne d'emploi du temps"
+    _order = 'school_id, standard_id, day, period'
+
+    school_id = fields.Many2one('school.school', 'École', required=True,
+                                index=True, ondelete='cascade')
+    standard_id = fields.Many2one('school.standard', 'Classe', required=True,
+                                  index=True, ondelete='cascade')
+    subject_id = fields.Many2one('subject.subject', 'Matière', required=True,
+                                 ondelete='cascade')
+    teacher_id = fields.Many2one('school.teacher', 'Professeur', index=True,
+                                 ondelete='set null')
+    room_id = fields.Many2one('class.room', 'Salle', ondelete='set null')
+    day = fields.Selection([('0', 'Lundi'), ('1', 'Mardi'),
+                            ('2', 'Mercredi'), ('3', 'Jeudi'),
+                            ('4', 'Vendredi'), ('5', 'Samedi'),
+                            ('6', 'Dimanche')], 'Jour', required=True)
+    period = fields.Integer('Période', required=True)
+
+    _sql_constraints = [
+        ('class_slot_unique', 'unique(standard_id, day, period)',
+         "Une classe ne peut avoir deux cours en même temps!"),
+        ('teacher_slot_unique', 'unique(teacher_id, day, period)',
+         "Un professeur ne peut avoir deux cours en même temps!"),
+        ('room_slot_unique', 'unique(room_id, day, period)',
+         "Une salle ne peut accueillir deux cours en même temps!"),
+    ]
+
+    def name_get(self):
+        '''Display the subject and the slot'''
+        days = dict(self._fields['day']._description_selection(self.env))
+        return [(rec.id, _('%s (%s, période %s)') % (
+            rec.subject_id.name, days.get(rec.day), rec.period))
+            for rec in self]
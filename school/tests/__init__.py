@@ -4,3 +4,5 @@
 # A Module to School Management System
 # ----------------------------------------------------------
 from . import test_school
+from . import test_school_sequence
+from . import test_timetable
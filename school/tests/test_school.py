@@ -1,6 +1,12 @@
 # See LICENSE file for full copyright and licensing details.
 
+from odoo import fields
 from odoo.tests import common
+from odoo.exceptions import ValidationError
+from dateutil.relativedelta import relativedelta
+import base64
+import csv
+import io
 import time
 
 
@@ -64,3 +70,307 @@ class TestSchool(common.TransactionCase):
     def test_school(self):
         self.assertEqual(self.student_student.school_id,
                          self.student_student.standard_id.school_id)
+
+    def test_parent_import(self):
+        csv_data = ('name,email,relation,students\n'
+                    'Import Parent,import.parent@example.com,,%s\n'
+                    % self.student_done.pid)
+        parent_import = self.env['school.parent.import'].\
+            create({'import_file': base64.b64encode(csv_data.encode()),
+                    'batch_size': 10})
+        parent_import.action_start()
+        self.assertEqual(parent_import.total_lines, 1)
+        parent_import.action_process_batch()
+        self.assertEqual(parent_import.state, 'done')
+        parent = parent_import.line_ids.parent_id
+        self.assertEqual(parent.student_id, self.student_done)
+        self.assertTrue(parent.user_ids)
+        self.assertTrue(parent.user_setup_pending)
+        parent._cron_setup_parent_users()
+        self.assertFalse(parent.user_setup_pending or parent.user_setup_error)
+
+    def test_parent_class_links(self):
+        self.assertEqual(self.parent.standard_id,
+                         self.student_done.standard_id)
+        self.assertIn(self.parent, self.student_done.standard_id.get_parents())
+
+    def test_news_feed(self):
+        news_obj = self.env['student.news']
+        unread = news_obj.get_unread_count()
+        news = news_obj.create({'subject': 'Feed news',
+                                'date': fields.Datetime.now() +
+                                relativedelta(days=2),
+                                'user_ids': [(6, 0, [self.env.uid])]})
+        self.assertEqual(news_obj.get_unread_count(), unread + 1)
+        feed = news_obj.get_feed(limit=1)
+        self.assertEqual(feed['news'][0]['id'], news.id)
+        self.assertFalse(feed['news'][0]['read'])
+        news.mark_read()
+        self.assertEqual(news_obj.get_unread_count(), unread)
+        # News sent to everybody are counted without touching the users
+        news_obj.create({'subject': 'Broadcast news',
+                         'date': fields.Datetime.now() +
+                         relativedelta(days=2)})
+        self.assertEqual(news_obj.get_unread_count(), unread + 1)
+
+    def test_history_snapshot(self):
+        history_obj = self.env['student.history']
+        self.student_done.write({'state': 'done'})
+        year = self.student_done.year
+        history_obj.snapshot_year(year, self.student_done.school_id)
+        history_obj.snapshot_year(year, self.student_done.school_id)
+        history = history_obj.search([('student_id', '=',
+                                       self.student_done.id),
+                                      ('academice_year_id', '=', year.id)])
+        self.assertEqual(len(history), 1)
+        self.assertEqual(history.standard_id, self.student_done.standard_id)
+
+    def test_student_archive(self):
+        archive_obj = self.env['student.archive']
+        student = self.student_student.with_context(active_test=False)
+        user = student.user_id
+        pid = student.pid
+        reminder = self.env['student.reminder'].create(
+            {'stu_id': student.id, 'name': 'Archived reminder'})
+        teacher = self.env['school.teacher'].search([], limit=1)
+        teacher.student_id = [(4, student.id)]
+        archive_obj.archive_students(student)
+        self.assertFalse(student.exists())
+        archive = archive_obj.search([('pid', '=', pid)])
+        self.assertEqual(archive.state, 'alumni')
+        archive.action_restore()
+        restored = self.student_student_obj.with_context(
+            active_test=False).search([('pid', '=', pid)])
+        self.assertEqual(restored.user_id, user)
+        self.assertFalse(archive.exists())
+        self.assertFalse(reminder.exists())
+        self.assertEqual(self.env['student.reminder'].search(
+            [('stu_id', '=', restored.id)]).name, 'Archived reminder')
+        self.assertIn(restored, teacher.student_id)
+
+    def test_student_name_search(self):
+        student = self.student_done
+        part = student.pid[-3:]
+        results = self.student_student_obj.name_search(part)
+        self.assertIn(student.id, [res[0] for res in results])
+        self.student_done.parent_id = [(6, 0, self.parent.ids)]
+        results = self.student_student_obj.name_search(
+            self.parent.name.upper())
+        self.assertIn(student.id, [res[0] for res in results])
+
+    def test_standard_name_search(self):
+        standard_ids = [res[0] for res in
+                        self.school_standard_obj.name_search(
+                            self.std.display_key)]
+        self.assertIn(self.std.id, standard_ids)
+        standard_ids = [res[0] for res in
+                        self.school_standard_obj.name_search(
+                            self.std.medium_id.code)]
+        self.assertIn(self.std.id, standard_ids)
+        self.assertEqual(self.academic_year.name_get()[0][1],
+                         ' [2012]2012 Year')
+        year_ids = [res[0] for res in
+                    self.academic_year_obj.name_search('[2012]')]
+        self.assertIn(self.academic_year.id, year_ids)
+
+    def test_grade_lookup(self):
+        grade = self.env.ref('school.demo_student_grade_1')
+        grades, fails = grade.get_grades([95, 85, 89.5, 10, 120, None])
+        self.assertEqual(grades, ['A+', 'A', 'A', 'F', False, False])
+        self.assertEqual(fails, [False, False, False, True, False, False])
+        with self.assertRaises(ValidationError):
+            grade.write({'grade_ids': [(0, 0, {'grade': 'X',
+                                               'from_mark': 40,
+                                               'to_mark': 45})]})
+        line = grade.grade_ids.sorted('from_mark')[-1]
+        with self.assertRaises(ValidationError):
+            line.from_mark -= 5
+        # The cached table follows the lines
+        line.grade = 'A++'
+        self.assertEqual(grade.get_grades([100])[0], ['A++'])
+
+    def test_compute_results(self):
+        student = self.student_done
+        standard = student.standard_id
+        year = student.year
+        standard.subject_ids = [(6, 0, (self.subject1 + self.subject2).ids)]
+        self.subject1.write({'maximum_marks': 100, 'minimum_marks': 35,
+                             'weightage': 1})
+        self.subject2.write({'maximum_marks': 50, 'minimum_marks': 20,
+                             'weightage': 3})
+        year.grade_id = self.env.ref('school.demo_student_grade_1')
+        mark_obj = self.env['student.mark']
+        mark_obj.create([{'student_id': student.id, 'year_id': year.id,
+                          'subject_id': self.subject1.id, 'marks': 80},
+                         {'student_id': student.id, 'year_id': year.id,
+                          'subject_id': self.subject2.id, 'marks': 45}])
+        standard.compute_results(year)
+        # (80 / 100 * 1 + 45 / 50 * 3) / 4 = 87.5%
+        self.assertEqual(student.percentage, 87.5)
+        self.assertEqual(student.grade, 'A')
+        self.assertEqual(student.rank, 1)
+
+    def test_elective_allocation(self):
+        elective = self.env['subject.elective'].create({'name': 'Options'})
+        self.subject1.write({'elective_id': elective.id,
+                             'elective_capacity': 1})
+        self.subject2.write({'elective_id': elective.id,
+                             'elective_capacity': 1})
+        first, second = self.student_done, self.student_student
+        pref_obj = self.env['subject.elective.preference']
+        pref_obj.create([
+            {'elective_id': elective.id, 'student_id': first.id,
+             'subject_id': self.subject1.id, 'sequence': 1},
+            {'elective_id': elective.id, 'student_id': first.id,
+             'subject_id': self.subject2.id, 'sequence': 2},
+            {'elective_id': elective.id, 'student_id': second.id,
+             'subject_id': self.subject1.id, 'sequence': 1}])
+        stats = elective.allocate_students()[elective.id]
+        # Only the first student can take the second subject
+        self.assertEqual(self.subject1.student_ids, second)
+        self.assertEqual(self.subject2.student_ids, first)
+        self.assertEqual(stats['unassigned'], 0)
+
+    def test_class_roster(self):
+        student = self.student_done
+        student.write({'state': 'done', 'roll_no': 1})
+        standard = student.standard_id
+        self.assertIn(student.id, standard.get_roster_ids())
+        roster = {row['id']: row for row in standard.get_roster()}
+        self.assertEqual(roster[student.id]['pid'], student.pid)
+        # Writing unchanged values keeps the cached roster
+        version = standard.roster_version
+        student.write({'state': 'done', 'roll_no': 1})
+        self.assertEqual(standard.roster_version, version)
+        student.write({'state': 'draft'})
+        self.assertEqual(standard.roster_version, version + 1)
+        self.assertNotIn(student.id, standard.get_roster_ids())
+
+    def test_enrolment_report(self):
+        report_obj = self.env['school.enrolment.report']
+        self.student_done.write({'state': 'done'})
+        report_obj.refresh()
+        standard = self.student_done.standard_id
+        rows = report_obj.search([('standard_id', '=', standard.id)])
+        self.assertEqual(sum(rows.mapped('capacity')), standard.capacity)
+        done = rows.filtered(lambda row: row.state == 'done')
+        self.assertEqual(sum(done.mapped('student_count')) +
+                         sum(rows.mapped('remaining_seats')),
+                         standard.capacity)
+
+    def test_student_export(self):
+        student = self.student_done
+        export = self.env['student.export'].create({
+            'standard_id': student.standard_id.id})
+        rows = list(csv.reader(io.StringIO(
+            b''.join(export.iter_csv()).decode('utf-8'))))
+        count = self.env['student.student'].search_count(
+            [('standard_id', '=', student.standard_id.id)])
+        self.assertEqual(len(rows) - 1, count)
+        self.assertIn(student.pid, [row[0] for row in rows[1:]])
+
+    def test_student_events(self):
+        event_obj = self.env['student.event']
+        events = event_obj.search(
+            [('student_id', '=', self.student_student.id),
+             ('event_type', '=', 'state')], order='id')
+        self.assertEqual(events[-2:].mapped('new_state'), ['done', 'alumni'])
+        self.assertEqual(events[-1].old_state, 'done')
+        # Events of running transactions are not served yet
+        feed = event_obj.read_events()
+        self.assertNotIn(events[-1].id,
+                         [item['id'] for item in feed['events']])
+
+    def test_attendance(self):
+        student = self.student_done
+        student.write({'state': 'done'})
+        sheet_obj = self.env['school.attendance.sheet']
+        sheet = sheet_obj.mark_class(student.standard_id.id, '2012-05-10',
+                                     absent_ids=[student.id])
+        self.assertEqual(sheet.month_id, self.academic_month)
+        self.assertEqual(sheet.absent_ids, student)
+        self.assertEqual(sheet.student_count,
+                         len(student.standard_id.get_roster_ids()))
+        # Marking the session again updates the same sheet
+        self.assertEqual(sheet_obj.mark_class(student.standard_id.id,
+                                              '2012-05-10'), sheet)
+        self.assertFalse(sheet.absent_ids)
+        # A session without type can not be entered twice either
+        with self.assertRaises(ValidationError):
+            sheet_obj.create({'standard_id': student.standard_id.id,
+                              'date': '2012-05-10'})
+        sheet.absent_ids = student
+        self.env['school.attendance.summary'].update_summaries()
+        summaries = self.env['school.attendance.summary'].search(
+            [('student_id', '=', student.id),
+             ('year_id', '=', self.academic_year.id)])
+        self.assertEqual(len(summaries), 2)
+        for summary in summaries:
+            self.assertEqual((summary.sessions, summary.absent,
+                              summary.rate), (1, 1, 0.0))
+
+    def test_clone_structure(self):
+        source = self.env.ref('school.demo_school_1')
+        target = self.env.ref('school.demo_school_3')
+        standards = self.school_standard_obj.search([('school_id', '=',
+                                                      target.id)])
+        diff = source.clone_structure(target, dry_run=True)
+        self.assertEqual(self.school_standard_obj.search(
+            [('school_id', '=', target.id)]), standards)
+        self.assertEqual(source.clone_structure(target), diff)
+        clones = self.school_standard_obj.search(
+            [('school_id', '=', target.id)]) - standards
+        self.assertEqual(sorted(clones.mapped('name')),
+                         sorted(diff['create']))
+        # A second clone only keeps the existing classes
+        diff = source.clone_structure(target, dry_run=True)
+        self.assertFalse(diff['create'] or diff['subjects'] or
+                         diff['syllabus'])
+
+    def test_school_job(self):
+        students = self.student_student_obj.search(
+            [('school_id', '=', self.school_id.id)])
+        jobs = self.env['school.job'].enqueue(
+            students, '_assign_roll_no', 'Roll numbers', chunk_size=2)
+        self.assertEqual(jobs.total, len(students))
+        jobs._cron_run_jobs()
+        self.assertEqual((jobs.state, jobs.position), ('done', len(students)))
+        self.assertEqual(sorted(students.mapped('roll_no')),
+                         list(range(1, len(students) + 1)))
+        # A failing chunk stops the job where it was
+        job = self.env['school.job'].enqueue(students, '_missing_method',
+                                             'Failing')
+        job._cron_run_jobs()
+        self.assertEqual((job.state, job.position), ('failed', 0))
+        self.assertTrue(job.error)
+
+    def test_relation_counts(self):
+        students = self.student_student_obj.search(
+            [('school_id', '=', self.school_id.id)])
+        self.env['student.description'].create(
+            [{'des_id': self.student_student.id, 'name': name}
+             for name in ('Sport', 'Musique')])
+        students.invalidate_cache(['description_count'])
+        for student in students:
+            self.assertEqual(student.description_count,
+                             len(student.description))
+            self.assertEqual(student.history_count,
+                             len(student.history_ids))
+        action = self.student_student.with_context(
+            relation='description').action_view_relation()
+        self.assertEqual(self.env[action['res_model']].search(
+            action['domain']), self.student_student.description)
+
+    def test_reminder_digest(self):
+        reminder_obj = self.env['student.reminder']
+        today = fields.Date.today()
+        first = reminder_obj.create({'stu_id': self.student_done.id,
+                                     'name': 'First', 'date': today})
+        reminder_obj._cron_send_digest()
+        self.assertTrue(first.digest_sent)
+        # A reminder added after the run, even backdated, is still sent
+        late = reminder_obj.create({'stu_id': self.student_done.id,
+                                    'name': 'Late',
+                                    'date': today - relativedelta(days=3)})
+        reminder_obj._cron_send_digest()
+        self.assertTrue(late.digest_sent)
@@ -0,0 +1,66 @@
+# See LICENSE file for full copyright and licensing details.
+
+import threading
+
+from odoo import api, SUPERUSER_ID
+from odoo.tests import common
+
+
+class TestSchoolSequence(common.TransactionCase):
+
+    THREADS = 8
+    CALLS = 10
+    COUNT = 3
+
+    def setUp(self):
+        super(TestSchoolSequence, self).setUp()
+        # The workers use their own transactions: the counters under test
+        # have to be committed, and are removed again in tearDown.
+        self.codes = {'fast': 'test.school.sequence.fast',
+                      'gapless': 'test.school.sequence.gapless'}
+        with api.Environment.manage(), self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            env['school.sequence'].create([
+                {'code': self.codes['fast'], 'implementation': 'fast',
+                 'block_size': 5},
+                {'code': self.codes['gapless'],
+                 'implementation': 'gapless'}])
+
+    def tearDown(self):
+        with api.Environment.manage(), self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            env['school.sequence'].search(
+                [('code', 'in', list(self.codes.values()))]).unlink()
+        super(TestSchoolSequence, self).tearDown()
+
+    def _allocate(self, code, results, errors):
+        try:
+            for _call in range(self.CALLS):
+                with api.Environment.manage(), self.registry.cursor() as cr:
+                    env = api.Environment(cr, SUPERUSER_ID, {})
+                    results.extend(env['school.sequence'].next_codes(
+                        code, False, self.COUNT))
+        except Exception as e:
+            errors.append(e)
+
+    def _run_parallel(self, code):
+        results, errors = [], []
+        threads = [threading.Thread(target=self._allocate,
+                                    args=(code, results, errors))
+                   for _thread in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertFalse(errors)
+        self.assertEqual(len(results), self.THREADS * self.CALLS * self.COUNT)
+        self.assertEqual(len(set(results)), len(results))
+        return sorted(int(number) for number in results)
+
+    def test_fast_unique_under_parallel_load(self):
+        self._run_parallel(self.codes['fast'])
+
+    def test_gapless_unique_under_parallel_load(self):
+        numbers = self._run_parallel(self.codes['gapless'])
+        self.assertEqual(numbers, list(range(numbers[0],
+                                             numbers[0] + len(numbers))))
@@ -0,0 +1,55 @@
+# See LICENSE file for full copyright and licensing details.
+
+from odoo.tests import common
+
+from ..models.timetable import solve_timetable
+
+
+class TestTimetable(common.TransactionCase):
+
+    def _check_conflicts(self, lessons):
+        booked = set()
+        for class_id, _subject, teacher_id, room_id, slot in lessons:
+            for key in (('class', class_id), ('teacher', teacher_id),
+                        ('room', room_id)):
+                if key[1]:
+                    self.assertNotIn(key + (slot,), booked)
+                    booked.add(key + (slot,))
+
+    def test_solve_timetable(self):
+        # 20 classes of 28 periods, 5 teachers per subject
+        loads = {1: 5, 2: 5, 3: 4, 4: 4, 5: 3, 6: 3, 7: 2, 8: 2}
+        teachers = {subject: [subject * 10 + i for i in range(5)]
+                    for subject in loads}
+        groups = [(class_id, subject, teachers[subject], 100 + class_id,
+                   load) for class_id in range(1, 21)
+                  for subject, load in loads.items()]
+        placed, unplaced, moved = solve_timetable(groups, 5, 6)
+        self.assertFalse(unplaced)
+        self.assertFalse(moved)
+        self.assertEqual(len(placed), 20 * 28)
+        self._check_conflicts(placed)
+        # One teacher leaves: repair around the rest of the timetable
+        teacher = placed[0][2]
+        kept = [lesson for lesson in placed if lesson[2] != teacher]
+        groups = [(class_id, subject,
+                   [other for other in teachers[subject] if other != teacher],
+                   100 + class_id, loads[subject])
+                  for class_id, subject in {(lesson[0], lesson[1])
+                                            for lesson in placed
+                                            if lesson[2] == teacher}]
+        new, unplaced, moved = solve_timetable(groups, 5, 6, kept)
+        self.assertFalse(unplaced)
+        kept = [lesson[:4] + (moved.get(index, lesson[4]),)
+                for index, lesson in enumerate(kept)]
+        self.assertNotIn(teacher, [lesson[2] for lesson in new])
+        self._check_conflicts(kept + new)
+
+    def test_generate_timetable(self):
+        school = self.env.ref('school.demo_school_1')
+        school.generate_timetable()
+        lines = school.timetable_line_ids
+        self._check_conflicts([(line.standard_id.id, line.subject_id.id,
+                                line.teacher_id.id, line.room_id.id,
+                                school._timetable_slot(line))
+                               for line in lines])
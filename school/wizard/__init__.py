@@ -4,3 +4,5 @@ from . import assign_roll_no
 from . import move_standards
 from . import wiz_send_email
 from . import teriminate_reason
+from . import student_export
+from . import school_clone
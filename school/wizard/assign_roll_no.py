@@ -1,6 +1,6 @@
 # See LICENSE file for full copyright and licensing details.
 
-from odoo import models, fields
+from odoo import models, fields, _
 
 
 class AssignRollNo(models.TransientModel):
@@ -13,19 +13,16 @@ class AssignRollNo(models.TransientModel):
     medium_id = fields.Many2one('standard.medium', 'Moyen', required=True)
 
     def assign_rollno(self):
-        '''Method to assign roll no to students'''
+        '''Assign roll numbers to the students by name from a background
+           job'''
         student_obj = self.env['student.student']
-        # Search Student
+        jobs = self.env['school.job']
         for rec in self:
-            student_ids = student_obj.search([('standard_id', '=',
-                                               rec.standard_id.id),
-                                              ('medium_id', '=',
-                                               rec.medium_id.id)],
-                                             order="name")
-            # Assign roll no according to name.
-            number = 1
-            for student in student_ids:
-                number += 1
-                student.write({'roll_no': number})
-
-        return True
+            students = student_obj.search([('standard_id', '=',
+                                            rec.standard_id.id),
+                                           ('medium_id', '=',
+                                            rec.medium_id.id)],
+                                          order="name")
+            jobs |= jobs.enqueue(students, '_assign_roll_no',
+                                 _('Assigner les numéros de rôle'))
+        return jobs.action_view_jobs()
@@ -0,0 +1,53 @@
+# See LICENSE file for full copyright and licensing details.
+
+from odoo import models, fields, _
+
+
+class SchoolClone(models.TransientModel):
+    '''Clone the academic structure of a school into another one'''
+
+    _name = 'school.clone'
+    _description = "Cloner la structure d'une école"
+
+    source_school_id = fields.Many2one('school.school', 'École source',
+                                       required=True)
+    target_school_id = fields.Many2one('school.school', 'École cible',
+                                       required=True)
+    copy_subjects = fields.Boolean('Copier les matières', default=True)
+    copy_syllabus = fields.Boolean('Copier les programmes', default=True)
+    preview = fields.Text('Aperçu', readonly=True)
+
+    def _clone(self, dry_run):
+        self.ensure_one()
+        return self.source_school_id.clone_structure(
+            self.target_school_id, subjects=self.copy_subjects,
+            syllabus=self.copy_syllabus, dry_run=dry_run)
+
+    def _format_diff(self, diff):
+        lines = [_('Classes créées (%s):') % len(diff['create'])]
+        lines += ['  + %s' % name for name in diff['create']]
+        lines.append(_('Classes existantes conservées (%s):')
+                     % len(diff['kept']))
+        lines += ['  = %s' % name for name in diff['kept']]
+        lines.append(_('Matières ajoutées aux classes: %s')
+                     % diff['subjects'])
+        lines.append(_('Programmes copiés: %s') % diff['syllabus'])
+        return '\n'.join(lines)
+
+    def action_preview(self):
+        '''Show what the clone would do without writing anything'''
+        self.preview = self._format_diff(self._clone(dry_run=True))
+        return {'type': 'ir.actions.act_window',
+                'res_model': self._name,
+                'res_id': self.id,
+                'view_mode': 'form',
+                'target': 'new'}
+
+    def action_clone(self):
+        '''Clone the structure and open the classes of the target school'''
+        self._clone(dry_run=False)
+        return {'type': 'ir.actions.act_window',
+                'name': _('Classes'),
+                'res_model': 'school.standard',
+                'view_mode': 'tree,form',
+                'domain': [('school_id', '=', self.target_school_id.id)]}
@@ -0,0 +1,205 @@
+# See LICENSE file for full copyright and licensing details.
+
+import csv
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from contextlib import closing
+
+from werkzeug.urls import url_encode
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+DEFAULT_EXPORT_FIELDS = ('pid', 'student_name', 'student_code', 'school_id',
+                         'standard_id', 'roll_no', 'parent_id', 'state')
+
+
+class StudentExport(models.TransientModel):
+    '''Export students or the roster of a class in constant memory.
+
+       Student ids are read from a server-side cursor and their values are
+       read and written by chunks, the ORM cache being emptied after each
+       chunk, so the size of the school does not change the memory used.'''
+
+    _name = 'student.export'
+    _description = 'Export des étudiants'
+
+    CHUNK_SIZE = 1000
+    COPY_SIZE = 1 << 16
+
+    school_id = fields.Many2one('school.school', 'École')
+    standard_id = fields.Many2one('school.standard', 'Classe')
+    field_ids = fields.Many2many(
+        'ir.model.fields', string='Champs',
+        domain="[('model', '=', 'student.student'), ('store', '=', True), "
+               "('ttype', 'not in', ('binary', 'one2many'))]",
+        help="Champs exportés, les champs principaux si vide.")
+    file_format = fields.Selection([('csv', 'CSV'), ('xlsx', 'Excel')],
+                                   'Format', required=True, default='csv')
+
+    def _get_fields(self):
+        '''Exported fields of student.student'''
+        student_obj = self.env['student.student']
+        names = self.field_ids.mapped('name') or DEFAULT_EXPORT_FIELDS
+        return [student_obj._fields[name] for name in names
+                if name in student_obj._fields and
+                student_obj._fields[name].type not in ('binary', 'one2many')]
+
+    def _get_domain(self):
+        domain = []
+        if self.school_id:
+            domain.append(('school_id', '=', self.school_id.id))
+        if self.standard_id:
+            domain.append(('standard_id', '=', self.standard_id.id))
+        return domain
+
+    @api.model
+    def _format_value(self, field, value):
+        if field.type == 'many2one':
+            return value.display_name or ''
+        if field.type == 'many2many':
+            return ', '.join(value.mapped('display_name'))
+        if field.type == 'selection':
+            return dict(field._description_selection(self.env)).get(value,
+                                                                     '')
+        if field.type in ('date', 'datetime'):
+            return field.to_string(value) or ''
+        if value is False and field.type != 'boolean':
+            return ''
+        return value
+
+    def _iter_rows(self):
+        '''Yield the header then the rows of the export'''
+        self.ensure_one()
+        student_obj = self.env['student.student']
+        student_obj.check_access_rights('read')
+        export_fields = self._get_fields()
+        yield [field.string for field in export_fields]
+        query = student_obj._where_calc(self._get_domain())
+        student_obj._apply_ir_rules(query, 'read')
+        from_clause, where_clause, params = query.get_sql()
+        order = '"student_student".id'
+        if self.standard_id:
+            order = '"student_student".roll_no, ' + order
+        student_obj.flush()
+        cursor_name = 'student_export_%s' % self.id
+        with closing(self._cr._cnx.cursor(cursor_name)) as ids_cr:
+            ids_cr.itersize = self.CHUNK_SIZE
+            ids_cr.execute('SELECT "student_student".id FROM %s WHERE %s '
+                           'ORDER BY %s' % (from_clause,
+                                            where_clause or 'TRUE', order),
+                           params)
+            while True:
+                ids = [row[0] for row in ids_cr.fetchmany(self.CHUNK_SIZE)]
+                if not ids:
+                    break
+                for student in student_obj.browse(ids):
+                    yield [self._format_value(field, student[field.name])
+                           for field in export_fields]
+                student_obj.invalidate_cache()
+
+    def iter_csv(self):
+        '''Yield the CSV export as encoded blocks of rows'''
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for index, row in enumerate(self._iter_rows(), 1):
+            writer.writerow(row)
+            if not index % self.CHUNK_SIZE:
+                yield buf.getvalue().encode('utf-8')
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue().encode('utf-8')
+
+    def _write_csv(self, fileobj):
+        for block in self.iter_csv():
+            fileobj.write(block)
+
+    def _write_xlsx(self, fileobj):
+        if xlsxwriter is None:
+            raise UserError(_("La bibliothèque xlsxwriter n'est pas \
+installée, utilisez le format CSV."))
+        workbook = xlsxwriter.Workbook(fileobj, {'constant_memory': True,
+                                                 'in_memory': False})
+        worksheet = workbook.add_worksheet(_('Étudiants'))
+        for row_index, row in enumerate(self._iter_rows()):
+            worksheet.write_row(row_index, 0, row)
+        workbook.close()
+
+    def _get_filename(self):
+        name = (self.standard_id.display_name or self.school_id.name or
+                _('etudiants'))
+        return '%s.%s' % (name.replace('/', '-'), self.file_format)
+
+    def _get_mimetype(self):
+        if self.file_format == 'xlsx':
+            return ('application/vnd.openxmlformats-officedocument.'
+                    'spreadsheetml.sheet')
+        return 'text/csv'
+
+    def write_export(self, fileobj):
+        '''Write the export to a binary file object'''
+        self.ensure_one()
+        if self.file_format == 'xlsx':
+            self._write_xlsx(fileobj)
+        else:
+            self._write_csv(fileobj)
+
+    def _create_attachment(self, path):
+        '''Create an attachment of the export file at path, copied into the
+           file store by chunks under its checksum so the file is never
+           loaded in memory'''
+        attachment_obj = self.env['ir.attachment']
+        sha = hashlib.sha1()
+        with open(path, 'rb') as export_file:
+            for block in iter(lambda: export_file.read(self.COPY_SIZE), b''):
+                sha.update(block)
+        checksum = sha.hexdigest()
+        fname, full_path = attachment_obj._get_path(None, checksum)
+        if not os.path.exists(full_path):
+            shutil.copyfile(path, full_path)
+        # Removed by the garbage collector if this transaction rolls back
+        attachment_obj._mark_for_gc(fname)
+        return attachment_obj.create({'name': self._get_filename(),
+                                      'res_model': self._name,
+                                      'res_id': self.id,
+                                      'mimetype': self._get_mimetype(),
+                                      'type': 'binary',
+                                      'store_fname': fname,
+                                      'checksum': checksum,
+                                      'file_size': os.path.getsize(path)})
+
+    def _get_download_url(self):
+        '''URL of the streamed download route for this export'''
+        params = {'file_format': self.file_format}
+        if self.school_id:
+            params['school_id'] = self.school_id.id
+        if self.standard_id:
+            params['standard_id'] = self.standard_id.id
+        if self.field_ids:
+            params['fields'] = ','.join(self.field_ids.mapped('name'))
+        return '/school/export/students?' + url_encode(params)
+
+    def action_export(self):
+        '''Export to an attachment and download it. Without a file store
+           an attachment would be held in memory to reach the database, so
+           the export is streamed by the download route instead.'''
+        self.ensure_one()
+        if self.env['ir.attachment']._storage() != 'file':
+            return {'type': 'ir.actions.act_url',
+                    'url': self._get_download_url(),
+                    'target': 'self'}
+        with tempfile.NamedTemporaryFile(suffix='.' + self.file_format) as tmp:
+            self.write_export(tmp)
+            tmp.flush()
+            attachment = self._create_attachment(tmp.name)
+        return {'type': 'ir.actions.act_url',
+                'url': '/web/content/%s?download=true' % attachment.id,
+                'target': 'self'}
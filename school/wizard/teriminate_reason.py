@@ -16,6 +16,7 @@ class TerminateReason(models.TransientModel):
         self.env['student.student'
                  ].browse(self._context.get('active_id')
                           ).write({'state': 'terminate',
+                                   'leave_date': fields.Date.today(),
                                    'terminate_reason': self.reason,
                                    'active': False})
         student_obj = self.env['student.student'].\